@@ -3,6 +3,7 @@ from django.contrib import admin
 from django.template.defaultfilters import truncatechars
 from django.utils.translation import gettext_lazy as _
 from tinylinks.forms import TinylinkAdminForm
+from tinylinks.jobs import enqueue_validation
 from tinylinks.models import Tinylink, TinylinkLog
 
 
@@ -27,6 +28,7 @@ class TinylinkAdmin(admin.ModelAdmin):
                     "user",
                     "long_url",
                     "short_url",
+                    "cache_max_age",
                 ]
             },
         ),
@@ -37,7 +39,14 @@ class TinylinkAdmin(admin.ModelAdmin):
 
     url_truncated.short_description = _("Long URL")
 
+    def save_model(self, request, obj, form, change):
+        super(TinylinkAdmin, self).save_model(request, obj, form, change)
+        if "long_url" in form.changed_data:
+            enqueue_validation([obj], long_url_changed=change)
+
     def status(self, obj):
+        if obj.is_broken is None:
+            return _("Pending")
         if not obj.is_broken:
             return _("OK")
         return _("Link broken")
@@ -0,0 +1,152 @@
+"""Short URL allocation for the ``django-tinylinks`` app."""
+import hashlib
+import os
+import threading
+from collections import deque
+from itertools import count
+
+from django.conf import settings
+from django.db import transaction
+from django.utils.crypto import get_random_string
+
+from tinylinks.models import ShortUrlSequence
+
+ALPHABET = "abcdefghijkmnpqrstuvwxyz123456789"
+
+ROUNDS = 4
+
+
+def _round(key, i, value, modulus):
+    data = "{}:{}".format(i, value).encode("utf-8")
+    digest = hashlib.blake2b(data, key=key.encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "little") % modulus
+
+
+def _split(length):
+    return len(ALPHABET) ** (length // 2), len(ALPHABET) ** (length - length // 2)
+
+
+def permute(value, length, key):
+    """
+    Maps ``value`` to another number below ``len(ALPHABET) ** length``.
+
+    Different values are mapped to different numbers, so consecutive values
+    of a sequence become unique numbers which look random. This is a small
+    Feistel cipher, ``unpermute`` reverses it.
+
+    """
+    a, b = _split(length)
+    for i in range(ROUNDS):
+        left, right = divmod(value, b)
+        value = a * right + (left + _round(key, i, right, a)) % a
+    return value
+
+
+def unpermute(value, length, key):
+    a, b = _split(length)
+    for i in reversed(range(ROUNDS)):
+        right, left = divmod(value, a)
+        value = b * ((left - _round(key, i, right, a)) % a) + right
+    return value
+
+
+def encode(value, length):
+    """Returns ``value`` written with ``length`` characters of the alphabet."""
+    chars = []
+    for _ in range(length):
+        value, digit = divmod(value, len(ALPHABET))
+        chars.append(ALPHABET[digit])
+    return "".join(reversed(chars))
+
+
+def decode(short_url):
+    value = 0
+    for char in short_url:
+        value = value * len(ALPHABET) + ALPHABET.index(char)
+    return value
+
+
+class ShortUrlAllocator(object):
+    """
+    Hands out short URLs which are unique by construction.
+
+    Each short URL length has a ``ShortUrlSequence``. Its values are permuted
+    with the secret key of the sequence and encoded with the alphabet, so no
+    query is needed to find an unused short URL. Once all short URLs of a
+    length are used, the next length is started.
+
+    Every worker process reserves ``block_size`` short URLs at once and hands
+    them out from memory, so that processes creating tinylinks don't wait for
+    each other. Short URLs which are still reserved when a process exits are
+    never used. Within transactions only the requested short URLs are
+    reserved, because a rollback would make the sequence hand out the block
+    again.
+
+    :block_size: Number of short URLs reserved at once. ``1`` reserves every
+      short URL on its own.
+
+    """
+
+    def __init__(self, block_size=100):
+        self.block_size = block_size
+        self._length = None
+        self._block = deque()
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def allocate(self):
+        """Returns a new short URL."""
+        return self.allocate_many(1)[0]
+
+    def allocate_many(self, amount):
+        """Returns ``amount`` new short URLs."""
+        with self._lock:
+            if self._pid != os.getpid():
+                # Don't share the reserved block with forked processes.
+                self._block.clear()
+                self._pid = os.getpid()
+            short_urls = []
+            while len(short_urls) < amount:
+                if not self._block:
+                    missing = amount - len(short_urls)
+                    if not transaction.get_connection().in_atomic_block:
+                        missing = max(missing, self.block_size)
+                    self._block.extend(self.reserve(missing))
+                short_urls.append(self._block.popleft())
+            return short_urls
+
+    def reserve(self, amount):
+        """
+        Returns up to ``amount`` new short URLs of the same length.
+
+        Less short URLs are returned if the current length runs out of them.
+
+        """
+        min_length = getattr(settings, "TINYLINK_LENGTH", 6)
+        if self._length is None or self._length < min_length:
+            self._length = min_length
+        with transaction.atomic():
+            for length in count(self._length):
+                sequence, created = ShortUrlSequence.objects.get_or_create(
+                    length=length, defaults={"key": get_random_string(32)}
+                )
+                if not created:
+                    sequence = ShortUrlSequence.objects.select_for_update().get(
+                        pk=sequence.pk
+                    )
+                space = len(ALPHABET) ** length
+                if sequence.next_value < space:
+                    break
+            start = sequence.next_value
+            sequence.next_value = min(start + amount, space)
+            sequence.save(update_fields=["next_value"])
+        self._length = length
+        return [
+            encode(permute(value, length, sequence.key), length)
+            for value in range(start, sequence.next_value)
+        ]
+
+
+short_url_allocator = ShortUrlAllocator(
+    block_size=getattr(settings, "TINYLINK_SHORT_URL_BLOCK_SIZE", 100),
+)
@@ -0,0 +1,12 @@
+"""App configuration for the ``django-tinylinks`` app."""
+from django.apps import AppConfig
+from django.utils.translation import gettext_lazy as _
+
+
+class TinylinksConfig(AppConfig):
+    name = "tinylinks"
+    verbose_name = _("Tinylinks")
+    default_auto_field = "django.db.models.AutoField"
+
+    def ready(self):
+        from tinylinks import signals  # noqa
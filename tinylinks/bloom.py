@@ -0,0 +1,236 @@
+"""Bloom filter of all existing short URLs for the ``django-tinylinks`` app."""
+import hashlib
+import logging
+import math
+import threading
+import time
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+
+from tinylinks.models import Tinylink
+
+logger = logging.getLogger(__name__)
+
+CREATED_KEY = "tinylinks:bloom:created"
+RENAMED_KEY = "tinylinks:bloom:renamed"
+
+# Rows created shortly before the last synchronisation may be committed after
+# it, so every synchronisation looks that many primary keys back.
+SYNC_OVERLAP = 100
+
+
+class BloomFilter(object):
+    """
+    Compact set of strings which answers membership tests with false
+    positives but without false negatives.
+
+    :capacity: Number of items the filter is sized for.
+    :error_rate: False positive rate once ``capacity`` items are added.
+
+    """
+
+    def __init__(self, capacity, error_rate):
+        self.capacity = max(capacity, 1)
+        self.error_rate = error_rate
+        self.num_bits = int(
+            math.ceil(-self.capacity * math.log(error_rate) / math.log(2) ** 2)
+        )
+        self.num_hashes = max(
+            int(round(self.num_bits / self.capacity * math.log(2))), 1
+        )
+        self.count = 0
+        self._bits = bytearray((self.num_bits + 7) // 8)
+
+    def _positions(self, item):
+        digest = hashlib.blake2b(item.encode("utf-8"), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        for i in range(self.num_hashes):
+            yield (h1 + i * h2) % self.num_bits
+
+    def add(self, item):
+        for position in self._positions(item):
+            self._bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, item):
+        for position in self._positions(item):
+            if not self._bits[position >> 3] & (1 << (position & 7)):
+                return False
+        return True
+
+    def info(self):
+        """Returns the size and the expected false positive rate."""
+        fill_rate = 1 - math.exp(-self.num_hashes * self.count / self.num_bits)
+        return {
+            "capacity": self.capacity,
+            "count": self.count,
+            "size": len(self._bits),
+            "num_hashes": self.num_hashes,
+            "error_rate": fill_rate**self.num_hashes,
+        }
+
+
+class ShortUrlFilter(object):
+    """
+    Keeps a ``BloomFilter`` of all short URLs in sync with the database.
+
+    The filter is built by a background thread on first use and extended
+    every ``sync_interval`` seconds. Until it is built, every short URL is
+    considered to exist. Other worker processes announce created and renamed
+    tinylinks through counters in the shared cache. Once they changed, short
+    URLs missing from the filter are looked up again until the next
+    synchronisation. Without a shared cache which other processes see,
+    missing short URLs are always looked up.
+
+    """
+
+    def __init__(self, enabled, capacity, error_rate, sync_interval):
+        self.enabled = enabled
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.sync_interval = sync_interval
+        self.bloom = None
+        self._max_pk = 0
+        self._generations = {}
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def might_exist(self, short_url):
+        """Returns ``False`` if ``short_url`` definitely doesn't exist."""
+        if not self.enabled:
+            return True
+        if self._thread is None or not self._thread.is_alive():
+            self.start()
+        bloom = self.bloom
+        if bloom is None or short_url in bloom:
+            return True
+        # Tinylinks created since the last synchronisation are missing.
+        generations = self._get_generations()
+        return not generations or generations != self._generations
+
+    def add(self, short_url):
+        bloom = self.bloom
+        if bloom is not None:
+            with self._lock:
+                bloom.add(short_url)
+
+    def start(self):
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(
+                target=self._run, name=type(self).__name__, daemon=True
+            )
+            self._thread.start()
+
+    def rebuild(self):
+        """Builds a new filter from all short URLs in the database."""
+        generations = self._get_generations()
+        rows = Tinylink.objects.values_list("pk", "short_url")
+        bloom = BloomFilter(max(self.capacity, 2 * rows.count()), self.error_rate)
+        max_pk = 0
+        for pk, short_url in rows.order_by().iterator(chunk_size=10000):
+            bloom.add(short_url)
+            max_pk = max(max_pk, pk)
+        with self._lock:
+            self.bloom = bloom
+            self._max_pk = max_pk
+            self._generations = generations
+
+    def sync(self):
+        """Adds new short URLs or rebuilds the filter if necessary."""
+        if self.bloom is None:
+            self.rebuild()
+            return
+        generations = self._get_generations()
+        if generations and generations == self._generations:
+            # Nothing has been created or renamed in the meantime.
+            return
+        if generations.get(RENAMED_KEY) != self._generations.get(RENAMED_KEY):
+            self.rebuild()
+            return
+        rows = Tinylink.objects.filter(pk__gt=self._max_pk - SYNC_OVERLAP).values_list(
+            "pk", "short_url"
+        )
+        with self._lock:
+            for pk, short_url in rows.order_by().iterator():
+                self.bloom.add(short_url)
+                self._max_pk = max(self._max_pk, pk)
+            self._generations = generations
+
+    def info(self):
+        if self.bloom is None:
+            return None
+        return self.bloom.info()
+
+    def _get_generations(self):
+        from tinylinks.cache import get_cross_process_cache
+
+        shared_cache = get_cross_process_cache()
+        if shared_cache is None:
+            return {}
+        generations = shared_cache.get_many([CREATED_KEY, RENAMED_KEY])
+        for key in {CREATED_KEY, RENAMED_KEY} - set(generations):
+            shared_cache.add(key, 0, None)
+            generations[key] = shared_cache.get(key)
+        return generations
+
+    def _run(self):
+        while True:
+            close_old_connections()
+            try:
+                self.sync()
+            except Exception:
+                logger.exception("Synchronising the short URL filter failed.")
+            time.sleep(self.sync_interval)
+
+
+short_url_filter = ShortUrlFilter(
+    enabled=getattr(settings, "TINYLINK_BLOOM_FILTER", False),
+    capacity=getattr(settings, "TINYLINK_BLOOM_CAPACITY", 1000000),
+    error_rate=getattr(settings, "TINYLINK_BLOOM_ERROR_RATE", 0.01),
+    sync_interval=getattr(settings, "TINYLINK_BLOOM_SYNC_INTERVAL", 5),
+)
+
+
+def announce_short_url(short_url, renamed=False):
+    """
+    Adds ``short_url`` to the local filter and tells other worker processes
+    to pick it up.
+
+    """
+    announce_short_urls([short_url], renamed)
+
+
+def announce_short_urls(short_urls, renamed=False):
+    """
+    Adds several short URLs to the local filter and tells other worker
+    processes to pick them up.
+
+    Call it after creating tinylinks without ``save``, e.g. with
+    ``bulk_create``. The other processes are told once the current
+    transaction is committed, so that they find the new rows.
+
+    """
+    if not short_url_filter.enabled:
+        return
+    for short_url in short_urls:
+        short_url_filter.add(short_url)
+    key = RENAMED_KEY if renamed else CREATED_KEY
+    transaction.on_commit(lambda: increment_generation(key))
+
+
+def increment_generation(key):
+    from tinylinks.cache import get_cross_process_cache
+
+    shared_cache = get_cross_process_cache()
+    if shared_cache is None:
+        return
+    shared_cache.add(key, 0, None)
+    try:
+        shared_cache.incr(key)
+    except ValueError:
+        # The counter has been evicted in the meantime.
+        shared_cache.set(key, 1, None)
@@ -0,0 +1,220 @@
+"""Buffered database writers for the redirect path of ``django-tinylinks``."""
+import atexit
+import logging
+import threading
+from collections import Counter, defaultdict
+
+from django.conf import settings
+from django.db import IntegrityError, close_old_connections, transaction
+from django.db.models import F
+
+from tinylinks.models import Tinylink, TinylinkLog
+
+logger = logging.getLogger(__name__)
+
+# Keeps ``IN`` clauses below the variable limits of all supported backends.
+CHUNK_SIZE = 500
+
+
+class BufferedWriter(object):
+    """
+    Base class for writers which collect items in memory and write them to the
+    database or the shared cache from a background thread.
+
+    Subclasses implement ``flush``. It is called every ``interval`` seconds,
+    whenever ``wakeup`` is called and once more when the process exits.
+
+    :interval: Seconds between two flushes. ``0`` disables the buffering and
+      makes subclasses write synchronously.
+
+    """
+
+    def __init__(self, interval):
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+        atexit.register(self.flush)
+
+    def start(self):
+        """Starts the background thread, unless it is already running."""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(
+                target=self._run, name=type(self).__name__, daemon=True
+            )
+            self._thread.start()
+
+    def wakeup(self):
+        """Makes the background thread flush immediately."""
+        self._wakeup.set()
+
+    def flush(self):
+        raise NotImplementedError
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+            close_old_connections()
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("Flushing %s failed.", type(self).__name__)
+
+
+class ViewCounter(BufferedWriter):
+    """
+    Adds up the views of all tinylinks and writes them as ``F()`` updates.
+
+    One ``UPDATE`` is issued per distinct increment and flush, so that hot
+    links cost one write per interval instead of one write per click.
+
+    """
+
+    def __init__(self, interval):
+        super(ViewCounter, self).__init__(interval)
+        self._pending = Counter()
+
+    def increment(self, pk, amount=1):
+        if not self.interval:
+            self._write({pk: amount})
+            return
+        with self._lock:
+            self._pending[pk] += amount
+        self.start()
+
+    def pending(self):
+        with self._lock:
+            return sum(self._pending.values())
+
+    def flush(self):
+        with self._flush_lock:
+            with self._lock:
+                pending, self._pending = self._pending, Counter()
+            if not pending:
+                return
+            try:
+                self._write(pending)
+            except Exception:
+                # Keep the increments for the next attempt.
+                with self._lock:
+                    self._pending.update(pending)
+                raise
+
+    def _write(self, pending):
+        pks_by_amount = defaultdict(list)
+        for pk, amount in pending.items():
+            pks_by_amount[amount].append(pk)
+        for amount, pks in pks_by_amount.items():
+            for i in range(0, len(pks), CHUNK_SIZE):
+                Tinylink.objects.filter(pk__in=pks[i : i + CHUNK_SIZE]).update(
+                    amount_of_views=F("amount_of_views") + amount
+                )
+
+
+class LogWriter(BufferedWriter):
+    """
+    Queues ``TinylinkLog`` instances and inserts them with ``bulk_create``.
+
+    A flush is triggered every ``interval`` seconds or as soon as
+    ``batch_size`` entries are waiting. If the database can't keep up and
+    ``max_size`` entries are waiting, new entries are dropped and counted
+    instead of slowing down the redirects. Entries whose tinylink was deleted
+    in the meantime are inserted without it. Entries which still can't be
+    inserted are dropped, so that they don't block the entries after them.
+
+    """
+
+    def __init__(self, interval, batch_size=500, max_size=10000):
+        super(LogWriter, self).__init__(interval)
+        self.batch_size = batch_size
+        self.max_size = max_size
+        self.dropped = 0
+        self._reported_dropped = 0
+        self._pending = []
+
+    def add(self, log):
+        if not self.interval:
+            log.save()
+            return
+        with self._lock:
+            if len(self._pending) >= self.max_size:
+                self.dropped += 1
+                return
+            self._pending.append(log)
+            batch_ready = len(self._pending) >= self.batch_size
+        self.start()
+        if batch_ready:
+            self.wakeup()
+
+    def pending(self):
+        with self._lock:
+            return len(self._pending)
+
+    def flush(self):
+        with self._flush_lock:
+            while True:
+                with self._lock:
+                    batch = self._pending[: self.batch_size]
+                    del self._pending[: self.batch_size]
+                if not batch:
+                    break
+                try:
+                    self._insert(batch)
+                except Exception:
+                    with self._lock:
+                        space = max(self.max_size - len(self._pending), 0)
+                        self._pending[:0] = batch[:space]
+                        self.dropped += len(batch[space:])
+                    raise
+            if self.dropped > self._reported_dropped:
+                logger.warning(
+                    "Dropped %d tinylink logs.",
+                    self.dropped - self._reported_dropped,
+                )
+                self._reported_dropped = self.dropped
+
+    def _insert(self, batch):
+        try:
+            TinylinkLog.objects.bulk_create(batch)
+            return
+        except IntegrityError:
+            pass
+        # Tinylinks may have been deleted since their clicks were queued.
+        # Their logs lose the tinylink, like with ``on_delete=SET_NULL``.
+        pks = {log.tinylink_id for log in batch if log.tinylink_id is not None}
+        existing = set(Tinylink.objects.filter(pk__in=pks).values_list("pk", flat=True))
+        for log in batch:
+            if log.tinylink_id not in existing:
+                log.tinylink_id = None
+            log.pk = None
+        try:
+            TinylinkLog.objects.bulk_create(batch)
+            return
+        except IntegrityError:
+            pass
+        for log in batch:
+            log.pk = None
+            try:
+                with transaction.atomic():
+                    log.save(force_insert=True)
+            except IntegrityError:
+                logger.exception("Inserting a tinylink log failed.")
+                with self._lock:
+                    self.dropped += 1
+
+
+view_counter = ViewCounter(
+    interval=getattr(settings, "TINYLINK_VIEW_COUNTER_INTERVAL", 10),
+)
+
+log_writer = LogWriter(
+    interval=getattr(settings, "TINYLINK_LOG_INTERVAL", 2),
+    batch_size=getattr(settings, "TINYLINK_LOG_BATCH_SIZE", 500),
+    max_size=getattr(settings, "TINYLINK_LOG_BUFFER_SIZE", 10000),
+)
@@ -0,0 +1,299 @@
+"""Redirect lookup caches for the ``django-tinylinks`` app."""
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import DEFAULT_CACHE_ALIAS, caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import transaction
+from django.urls import reverse
+from django.utils.module_loading import import_string
+
+from tinylinks.bloom import short_url_filter
+from tinylinks.models import Tinylink
+from tinylinks.snapshot import snapshot_loader
+
+RedirectTarget = namedtuple(
+    "RedirectTarget", ["pk", "long_url", "max_age"], defaults=[None]
+)
+
+SHORT_URL_MAX_LENGTH = Tinylink._meta.get_field("short_url").max_length
+
+# Cache backends whose entries other worker processes don't see.
+PROCESS_LOCAL_BACKENDS = (DummyCache, LocMemCache)
+
+
+class RedirectCache(object):
+    """
+    Bounded least-recently-used cache for resolved redirect targets.
+
+    Every worker process holds its own instance, so entries are only shared
+    between the threads of one process. Invalidations only reach the
+    process which saved the tinylink, the other processes serve their entry
+    until it expires after ``timeout`` seconds.
+
+    :maxsize: Maximum amount of cached short URLs. ``0`` disables the cache.
+    :timeout: Seconds after which an entry is considered stale. ``None``
+      keeps entries until they are evicted or invalidated.
+
+    """
+
+    def __init__(self, maxsize=1024, timeout=60):
+        self.maxsize = maxsize
+        self.timeout = timeout
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, short_url):
+        """Returns the cached target of ``short_url`` or ``None``."""
+        with self._lock:
+            entry = self._entries.get(short_url)
+            if entry is not None:
+                target, expires = entry
+                if expires is None or expires > time.monotonic():
+                    self._entries.move_to_end(short_url)
+                    self.hits += 1
+                    return target
+                del self._entries[short_url]
+            self.misses += 1
+            return None
+
+    def set(self, short_url, target):
+        """Stores ``target`` and evicts the least recently used entries."""
+        if not self.maxsize:
+            return
+        expires = None
+        if self.timeout is not None:
+            expires = time.monotonic() + self.timeout
+        with self._lock:
+            self._entries[short_url] = (target, expires)
+            self._entries.move_to_end(short_url)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def delete(self, short_url):
+        with self._lock:
+            self._entries.pop(short_url, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def info(self):
+        """Returns the hit and miss counters and the current fill level."""
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "size": len(self._entries),
+                "maxsize": self.maxsize,
+            }
+
+
+redirect_cache = RedirectCache(
+    maxsize=getattr(settings, "TINYLINK_REDIRECT_CACHE_SIZE", 1024),
+    timeout=getattr(settings, "TINYLINK_REDIRECT_CACHE_TIMEOUT", 60),
+)
+
+
+def get_shared_cache():
+    """
+    Returns the Django cache shared by all workers or ``None`` if disabled.
+
+    """
+    alias = getattr(settings, "TINYLINK_CACHE_ALIAS", DEFAULT_CACHE_ALIAS)
+    if not alias:
+        return None
+    return caches[alias]
+
+
+def get_cross_process_cache():
+    """
+    Returns the shared cache if other worker processes see its entries,
+    otherwise ``None``.
+
+    """
+    shared_cache = get_shared_cache()
+    if isinstance(shared_cache, PROCESS_LOCAL_BACKENDS):
+        return None
+    return shared_cache
+
+
+def get_cache_key(short_url):
+    return "tinylinks:redirect:{}".format(short_url)
+
+
+def lookup_tinylink(short_url):
+    """
+    Resolves a short URL into a ``RedirectTarget`` or ``None``.
+
+    Lookups go through the process-wide ``redirect_cache`` first. Short URLs
+    which are missing from the ``short_url_filter`` are rejected without a
+    database lookup, all others are looked up in the shared Django cache, the redirect snapshot
+    and only then in the database. Only the primary key, the long URL and the
+    cache max age are loaded. Unknown short URLs are remembered in the
+    shared cache for a short time, so that scans for random codes don't
+    reach the database.
+
+    """
+    if len(short_url) > SHORT_URL_MAX_LENGTH:
+        return None
+    target = redirect_cache.get(short_url)
+    if target is not None:
+        return target
+    if not short_url_filter.might_exist(short_url):
+        return None
+    return _load_tinylink(short_url)
+
+
+async def alookup_tinylink(short_url):
+    """
+    Asynchronous version of ``lookup_tinylink``.
+
+    Hits of the process-wide ``redirect_cache`` are answered without leaving
+    the event loop, only the shared cache and database lookups are handed to
+    a worker thread.
+
+    """
+    if len(short_url) > SHORT_URL_MAX_LENGTH:
+        return None
+    target = redirect_cache.get(short_url)
+    if target is not None:
+        return target
+    if not short_url_filter.might_exist(short_url):
+        return None
+    return await sync_to_async(_load_tinylink)(short_url)
+
+
+def _load_tinylink(short_url):
+    shared_cache = get_shared_cache()
+    if shared_cache is not None:
+        cached = shared_cache.get(get_cache_key(short_url))
+        if cached is not None:
+            if not cached:
+                return None
+            target = RedirectTarget(*cached)
+            redirect_cache.set(short_url, target)
+            return target
+
+    row = snapshot_loader.lookup(short_url)
+    if row is not None:
+        target = RedirectTarget(*row)
+        redirect_cache.set(short_url, target)
+        return target
+
+    try:
+        row = Tinylink.objects.values_list("pk", "long_url", "cache_max_age").get(
+            short_url=short_url
+        )
+    except Tinylink.DoesNotExist:
+        if shared_cache is not None:
+            shared_cache.set(
+                get_cache_key(short_url),
+                (),
+                getattr(settings, "TINYLINK_NOT_FOUND_CACHE_TIMEOUT", 30),
+            )
+        return None
+    target = RedirectTarget(*row)
+    if shared_cache is not None:
+        shared_cache.set(
+            get_cache_key(short_url),
+            tuple(target),
+            getattr(settings, "TINYLINK_CACHE_TIMEOUT", 300),
+        )
+    redirect_cache.set(short_url, target)
+    return target
+
+
+def invalidate_tinylink(tinylink, deleted=False):
+    """
+    Drops all cached targets of a tinylink.
+
+    This includes the short URL the instance was loaded with, in case it has
+    been changed in the meantime. If a redirect snapshot is used, the shared
+    cache entries are replaced instead, because they have to override the
+    outdated snapshot. They expire with the snapshots built before.
+
+    The entries are dropped once the current transaction is committed, so
+    that concurrent redirects can't cache the old row again.
+
+    """
+    short_urls = {tinylink.short_url, getattr(tinylink, "_loaded_short_url", None)}
+    short_urls -= {None}
+    for short_url in short_urls:
+        redirect_cache.delete(short_url)
+    shared_cache = get_shared_cache()
+    if shared_cache is None:
+        return
+    if snapshot_loader.enabled:
+        values = {get_cache_key(s): () for s in short_urls}
+        if not deleted:
+            values[get_cache_key(tinylink.short_url)] = (
+                tinylink.pk,
+                tinylink.long_url,
+                tinylink.cache_max_age,
+            )
+        transaction.on_commit(
+            lambda: shared_cache.set_many(values, snapshot_loader.max_age)
+        )
+    else:
+        transaction.on_commit(lambda: drop_cached_targets(short_urls))
+
+
+def invalidate_short_urls(short_urls):
+    """
+    Drops cached targets of short URLs, e.g. after creating tinylinks with
+    ``bulk_create``.
+
+    The entries are dropped once the current transaction is committed.
+
+    """
+    short_urls = list(short_urls)
+    for short_url in short_urls:
+        redirect_cache.delete(short_url)
+    transaction.on_commit(lambda: drop_cached_targets(short_urls))
+
+
+def drop_cached_targets(short_urls):
+    # Redirects served before the commit may have cached the old targets
+    # in this process again.
+    for short_url in short_urls:
+        redirect_cache.delete(short_url)
+    shared_cache = get_shared_cache()
+    if shared_cache is not None:
+        shared_cache.delete_many([get_cache_key(s) for s in short_urls])
+
+
+def purge_tinylink(tinylink, deleted=False):
+    """
+    Tells the ``TINYLINK_PURGE_CALLBACK`` which redirect paths are outdated.
+
+    The callback is called with a list of paths once the current transaction
+    is committed. It is only called if the long URL, the short URL or the
+    cache max age of the tinylink has been changed or if the tinylink has
+    been deleted.
+
+    """
+    callback = getattr(settings, "TINYLINK_PURGE_CALLBACK", None)
+    if not callback:
+        return
+    short_url = getattr(tinylink, "_loaded_short_url", None)
+    if deleted:
+        short_url = short_url or tinylink.short_url
+    elif short_url is None or (
+        short_url == tinylink.short_url
+        and tinylink.long_url == getattr(tinylink, "_loaded_long_url", None)
+        and tinylink.__dict__.get("cache_max_age")
+        == getattr(tinylink, "_loaded_cache_max_age", None)
+    ):
+        # The tinylink has just been created or its target didn't change.
+        return
+    path = reverse("tinylink_redirect", kwargs={"short_url": short_url})
+    transaction.on_commit(lambda: import_string(callback)([path]))
@@ -0,0 +1,68 @@
+"""URL canonicalization for the ``django-tinylinks`` app."""
+import re
+from functools import lru_cache
+from urllib.parse import urlsplit, urlunsplit
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+DEFAULT_PORTS = {"http": 80, "https": 443, "ftp": 21}
+
+UNRESERVED = frozenset(
+    "ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789-._~"
+)
+
+escape = re.compile(r"%[0-9a-fA-F]{2}")
+
+
+def _normalize_escape(match):
+    char = chr(int(match.group()[1:], 16))
+    if char in UNRESERVED:
+        return char
+    return match.group().upper()
+
+
+def canonicalize_url(url):
+    """
+    Returns a normalized version of ``url`` which is equal for URLs that
+    point to the same resource.
+
+    The scheme and the host are lowercased, default ports and trailing
+    slashes are removed, percent-encodings are normalized and the query
+    parameters are sorted. Fragments are kept, because single-page
+    applications route by them.
+
+    """
+    url = url.strip()
+    try:
+        parts = urlsplit(url)
+        port = parts.port
+    except ValueError:
+        return url
+    if not parts.scheme or not parts.hostname:
+        return url
+    scheme = parts.scheme.lower()
+    netloc = parts.hostname.rstrip(".")
+    if ":" in netloc:
+        netloc = "[{}]".format(netloc)
+    if port is not None and port != DEFAULT_PORTS.get(scheme):
+        netloc = "{}:{}".format(netloc, port)
+    if "@" in parts.netloc:
+        netloc = "{}@{}".format(parts.netloc.rsplit("@", 1)[0], netloc)
+    path = escape.sub(_normalize_escape, parts.path).rstrip("/") or "/"
+    query = escape.sub(_normalize_escape, parts.query)
+    query = "&".join(sorted(param for param in query.split("&") if param))
+    return urlunsplit((scheme, netloc, path, query, parts.fragment))
+
+
+@lru_cache(maxsize=None)
+def _get_canonicalizer(path):
+    return import_string(path)
+
+
+def get_canonical_url(url):
+    """Canonicalizes ``url`` with the ``TINYLINK_URL_CANONICALIZER``."""
+    path = getattr(
+        settings, "TINYLINK_URL_CANONICALIZER", "tinylinks.canonical.canonicalize_url"
+    )
+    return _get_canonicalizer(path)(url)
@@ -0,0 +1,196 @@
+"""Concurrent checks of long URLs for the ``django-tinylinks`` app."""
+import asyncio
+import socket
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+from django.conf import settings
+from django.utils import timezone
+from django.utils.translation import gettext_lazy as _
+
+from tinylinks.models import Tinylink, check_long_url
+from tinylinks.scheduler import schedule_checks
+
+CHECK_FIELDS = [
+    "is_broken",
+    "validation_error",
+    "redirect_location",
+    "redirect_count",
+    "etag",
+    "last_modified",
+    "last_checked",
+    "check_failures",
+    "next_check",
+]
+
+DEFAULT_PORTS = {"http": 80, "https": 443}
+
+
+class HostBreaker(object):
+    """
+    Remembers hosts which failed repeatedly, so that their links are skipped.
+
+    After ``failures`` checks in a row which didn't receive a response, the
+    links of the host are skipped for ``cooldown`` seconds. The next check
+    after the cool-down decides whether the host is skipped again.
+
+    :failures: Number of failed checks in a row which open the breaker.
+    :cooldown: Seconds the links of a failing host are skipped.
+
+    """
+
+    def __init__(self, failures=3, cooldown=300):
+        self.failures = failures
+        self.cooldown = cooldown
+        self._failures = defaultdict(int)
+        self._open_until = {}
+
+    def is_open(self, host):
+        """Returns whether the links of ``host`` should be skipped."""
+        open_until = self._open_until.get(host)
+        return open_until is not None and time.monotonic() < open_until
+
+    def record(self, host, success):
+        if success:
+            self._failures.pop(host, None)
+            self._open_until.pop(host, None)
+            return
+        self._failures[host] += 1
+        if self._failures[host] >= self.failures:
+            self._open_until[host] = time.monotonic() + self.cooldown
+
+
+class HostCheck(object):
+    """
+    Finds the hosts of one run whose names don't resolve, so that their
+    links fail without a request.
+
+    Every host name is looked up once per run. The addresses aren't passed
+    on, the requests resolve the names again when they open connections.
+
+    """
+
+    def __init__(self):
+        self._lookups = {}
+
+    async def resolves(self, url):
+        """Returns whether the host of ``url`` can be resolved."""
+        try:
+            parts = urlsplit(url)
+            host = parts.hostname
+            port = parts.port or DEFAULT_PORTS.get(parts.scheme, 80)
+        except ValueError:
+            # The check reports invalid URLs.
+            return True
+        if not host:
+            return True
+        if (host, port) not in self._lookups:
+            self._lookups[(host, port)] = asyncio.ensure_future(self.lookup(host, port))
+        return await self._lookups[(host, port)]
+
+    async def lookup(self, host, port):
+        loop = asyncio.get_running_loop()
+        try:
+            await loop.getaddrinfo(host, port, type=socket.SOCK_STREAM)
+        except (socket.gaierror, UnicodeError):
+            return False
+        return True
+
+
+class LinkChecker(object):
+    """
+    Checks many long URLs at once with an asyncio event loop.
+
+    The requests run in threads on the shared connections of ``link_client``.
+    At most ``concurrency`` URLs are checked at the same time and at most
+    ``per_host`` of them on the same host, so that slow servers don't hold up
+    the whole run and no server is flooded. Links of hosts whose names don't
+    resolve fail without a request, see ``HostCheck``, and hosts which fail
+    repeatedly are skipped, see ``HostBreaker``.
+
+    :concurrency: Number of URLs checked at the same time.
+    :per_host: Number of URLs of one host checked at the same time.
+    :batch_size: Number of tinylinks saved per ``bulk_update`` query.
+    :breaker: The ``HostBreaker``, kept between runs.
+
+    """
+
+    def __init__(self, concurrency=50, per_host=4, batch_size=500, breaker=None):
+        self.concurrency = concurrency
+        self.per_host = per_host
+        self.batch_size = batch_size
+        self.breaker = breaker or HostBreaker()
+
+    def check(self, links):
+        """
+        Checks ``links``, schedules their next checks and saves the results.
+        Returns the links.
+
+        """
+        links = list(links)
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            asyncio.run(self.check_all(links, executor))
+        schedule_checks(links)
+        Tinylink.objects.bulk_update(links, CHECK_FIELDS, batch_size=self.batch_size)
+        return links
+
+    async def check_all(self, links, executor):
+        """Checks ``links`` without saving them."""
+        limit = asyncio.Semaphore(self.concurrency)
+        host_limits = defaultdict(lambda: asyncio.Semaphore(self.per_host))
+        hosts = HostCheck()
+        await asyncio.gather(
+            *[
+                self.check_link(link, executor, limit, host_limits, hosts)
+                for link in links
+            ]
+        )
+
+    async def check_link(self, link, executor, limit, host_limits, hosts):
+        loop = asyncio.get_running_loop()
+        host = get_host(link.long_url)
+        # Wait for the host first, so that links of busy hosts don't take
+        # the places of other links.
+        async with host_limits[host]:
+            async with limit:
+                if self.breaker.is_open(host):
+                    set_broken(link, _("Skipped, the host failed repeatedly."))
+                    return
+                if not await hosts.resolves(link.long_url):
+                    set_broken(link, _("Host not found."))
+                    self.breaker.record(host, success=False)
+                    return
+                try:
+                    await loop.run_in_executor(executor, check_long_url, link)
+                except Exception:
+                    set_broken(link, _("URL not accessible."))
+                self.breaker.record(
+                    host, success=not getattr(link, "host_unreachable", False)
+                )
+
+
+def get_host(url):
+    try:
+        return urlsplit(url).netloc.lower()
+    except ValueError:
+        return ""
+
+
+def set_broken(link, validation_error):
+    link.is_broken = True
+    link.validation_error = validation_error
+    link.redirect_location = ""
+    link.redirect_count = 0
+    link.last_checked = timezone.now()
+
+
+link_checker = LinkChecker(
+    concurrency=getattr(settings, "TINYLINK_CHECK_CONCURRENCY", 50),
+    per_host=getattr(settings, "TINYLINK_CHECK_PER_HOST", 4),
+    breaker=HostBreaker(
+        failures=getattr(settings, "TINYLINK_CHECK_HOST_FAILURES", 3),
+        cooldown=getattr(settings, "TINYLINK_CHECK_HOST_COOLDOWN", 300),
+    ),
+)
@@ -0,0 +1,198 @@
+"""Pooled HTTP client used to validate long URLs."""
+import os
+import socket
+import threading
+from http.cookies import CookieError, SimpleCookie
+from urllib.parse import urljoin, urlsplit
+
+from django.conf import settings
+from urllib3 import PoolManager
+from urllib3.connection import HTTPConnection
+
+# Status codes of servers which don't answer HEAD requests properly.
+HEAD_UNSUPPORTED = frozenset([405, 501])
+
+# Bodies up to this size are read to keep the connection open.
+MAX_DRAIN_SIZE = 64 * 1024
+
+
+class RedirectError(Exception):
+    """Raised if a redirect chain doesn't end."""
+
+
+class TooManyRedirects(RedirectError):
+    pass
+
+
+class RedirectLoop(RedirectError):
+    pass
+
+
+class ChainCookies(object):
+    """Cookies set by the servers of one redirect chain."""
+
+    def __init__(self):
+        self._cookies = {}
+
+    def update(self, url, response):
+        """Stores the cookies ``response`` sets for later requests."""
+        host = (urlsplit(url).hostname or "").lower()
+        for header in response.headers.getlist("Set-Cookie"):
+            cookie = SimpleCookie()
+            try:
+                cookie.load(header)
+            except CookieError:
+                continue
+            for name, morsel in cookie.items():
+                domain = morsel["domain"].lstrip(".").lower() or host
+                self._cookies[(domain, name)] = morsel.value
+
+    def header(self, url):
+        """Returns the ``Cookie`` header for a request to ``url``."""
+        host = (urlsplit(url).hostname or "").lower()
+        return "; ".join(
+            "{}={}".format(name, value)
+            for (domain, name), value in sorted(self._cookies.items())
+            if host == domain or host.endswith("." + domain)
+        )
+
+
+def follow_redirects(pool, url, headers=None, max_redirects=10, **kwargs):
+    """
+    Requests ``url`` with ``open_url`` and follows its redirects.
+
+    All requests of the chain use the connections of ``pool``. Cookies set
+    on the way are sent with the following requests, for servers which
+    redirect until they receive a cookie. Returns the last response, its URL
+    and the number of redirects.
+
+    Raises ``TooManyRedirects`` after ``max_redirects`` redirects and
+    ``RedirectLoop`` if a URL is requested twice with the same cookies.
+
+    """
+    cookies = ChainCookies()
+    seen = set()
+    hops = 0
+    while True:
+        request_headers = dict(headers or {})
+        cookie = cookies.header(url)
+        if cookie:
+            request_headers["Cookie"] = cookie
+        if (url, cookie) in seen:
+            raise RedirectLoop(url)
+        seen.add((url, cookie))
+        response = open_url(
+            pool, url, headers=request_headers, redirect=False, **kwargs
+        )
+        location = response.get_redirect_location()
+        if not location:
+            return response, url, hops
+        if hops == max_redirects:
+            raise TooManyRedirects(url)
+        cookies.update(url, response)
+        url = urljoin(url, location)
+        hops += 1
+
+
+def open_url(pool, url, method=None, **kwargs):
+    """
+    Requests the status and the headers of ``url`` without downloading its
+    body, so checking a link costs the same for every size of the target.
+
+    A ``HEAD`` request is sent first. If the server doesn't support it, a
+    streamed ``GET`` request is sent instead, which stops after the headers.
+    The connection is released right away, so the body of the returned
+    response can't be read.
+
+    """
+    kwargs["preload_content"] = False
+    if method is None:
+        response = pool.urlopen("HEAD", url, **kwargs)
+        # Responses to HEAD requests never have a body.
+        response.drain_conn()
+        response.release_conn()
+        if response.status not in HEAD_UNSUPPORTED:
+            return response
+        method = "GET"
+    response = pool.urlopen(method, url, **kwargs)
+    release_response(response)
+    return response
+
+
+def release_response(response):
+    """
+    Returns the connection of the streamed ``response`` to its pool.
+
+    Short bodies are read, so that the connection can be reused. The
+    connection of longer bodies is closed instead.
+
+    """
+    try:
+        length = int(response.headers.get("Content-Length"))
+    except (TypeError, ValueError):
+        length = None
+    if length is None or length > MAX_DRAIN_SIZE:
+        response.close()
+    else:
+        response.drain_conn()
+    response.release_conn()
+
+
+class LinkClient(object):
+    """
+    Process-wide pool of HTTP connections for link validations.
+
+    Connections are kept open between requests, so validating many long URLs
+    of the same host pays for the TCP and TLS handshakes only once per
+    connection. Forked processes create their own pool.
+
+    :num_pools: Number of hosts whose connections are kept.
+    :maxsize: Number of connections kept per host.
+    :keep_alive: Whether idle connections are kept open. TCP keep-alive
+      probes are sent on them, so dead connections are noticed.
+
+    """
+
+    def __init__(self, num_pools=10, maxsize=10, keep_alive=True):
+        self.num_pools = num_pools
+        self.maxsize = maxsize
+        self.keep_alive = keep_alive
+        self._pool = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    @property
+    def pool(self):
+        """Returns the ``PoolManager`` of the current process."""
+        with self._lock:
+            if self._pool is None or self._pid != os.getpid():
+                self._pool = self.create_pool()
+                self._pid = os.getpid()
+            return self._pool
+
+    def create_pool(self):
+        socket_options = list(HTTPConnection.default_socket_options)
+        headers = {}
+        if self.keep_alive:
+            socket_options.append((socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1))
+        else:
+            headers["Connection"] = "close"
+        return PoolManager(
+            num_pools=self.num_pools,
+            maxsize=self.maxsize,
+            headers=headers,
+            socket_options=socket_options,
+        )
+
+    def clear(self):
+        """Closes all kept connections."""
+        with self._lock:
+            if self._pool is not None:
+                self._pool.clear()
+
+
+link_client = LinkClient(
+    num_pools=getattr(settings, "TINYLINK_HTTP_NUM_POOLS", 10),
+    maxsize=getattr(settings, "TINYLINK_HTTP_MAXSIZE", 10),
+    keep_alive=getattr(settings, "TINYLINK_HTTP_KEEP_ALIVE", True),
+)
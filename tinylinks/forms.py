@@ -1,12 +1,11 @@
 """Forms for the ``django-tinylinks`` app."""
-import random
-
 from django import forms
-from django.conf import settings
 from django.forms.utils import ErrorList
 from django.utils.translation import gettext_lazy as _
 
-from tinylinks.models import Tinylink, validate_long_url
+from tinylinks.jobs import enqueue_validation
+from tinylinks.models import Tinylink
+from tinylinks.upsert import upsert_tinylink
 
 
 class TinylinkForm(forms.ModelForm):
@@ -67,49 +66,36 @@ class TinylinkForm(forms.ModelForm):
 
     def clean(self):
         self.cleaned_data = super(TinylinkForm, self).clean()
+        short_url = self.cleaned_data.get("short_url")
+        if not short_url:
+            # New tinylinks without a custom short URL are deduplicated and
+            # allocated on save.
+            return self.cleaned_data
         # If short URL is occupied throw out an error, or fail silent.
         try:
-            twin = Tinylink.objects.get(short_url=self.cleaned_data.get("short_url"))
+            twin = Tinylink.objects.get(short_url=short_url)
             if not self.instance == twin:
                 raise forms.ValidationError(
                     _("This short url already exists. Please try another one.")
                 )
-            return self.cleaned_data
         except Tinylink.DoesNotExist:
             pass
-        # Brothers are entities with the same long URL
-        brothers = Tinylink.objects.filter(
-            long_url=self.cleaned_data.get("long_url"), user=self.user
-        )
-        input_url = self.cleaned_data.get("short_url")
-
-        # Only handle with older brothers, if there's no new short URL value
-        if brothers and not input_url:
-            # This can only happen, if a user tries to auto-generate a
-            # short URL with an existing tinylink. She will receive the
-            # prefilled form with the link's old values.
-            self.instance = brothers[0]
-            self.cleaned_data.update({"short_url": self.instance.short_url})
-        else:
-            slug = ""
-            if input_url:
-                # User can customize their URLs
-                slug = input_url
-            # This keeps the unique validation of the short URLs alive.
-            if not Tinylink.objects.filter(short_url=input_url):
-                while not slug or Tinylink.objects.filter(short_url=slug):
-                    slug = "".join(
-                        random.choice("abcdefghijkmnpqrstuvwxyz123456789")
-                        for x in range(getattr(settings, "TINYLINK_LENGTH", 6))
-                    )
-                self.cleaned_data.update({"short_url": slug})
         return self.cleaned_data
 
     def save(self, *args, **kwargs):
-        if not self.instance.pk:
+        if not self.instance.pk and not self.instance.short_url:
+            # If the user already has a tinylink for the long URL, it is
+            # returned with its old values. New ones are queued for their
+            # validation.
+            self.instance = upsert_tinylink(self.instance.long_url, self.user)[0]
+            return self.instance
+        created = not self.instance.pk
+        if created:
             self.instance.user = self.user
         self.instance = super(TinylinkForm, self).save(*args, **kwargs)
-        return validate_long_url(self.instance)
+        if created or "long_url" in self.changed_data:
+            enqueue_validation([self.instance], long_url_changed=not created)
+        return self.instance
 
     class Meta:
         model = Tinylink
@@ -148,13 +134,8 @@ class TinylinkAdminForm(forms.ModelForm):
                 short_url=self.cleaned_data.get("short_url"),
             )
         except Tinylink.DoesNotExist:
-            slug = self.cleaned_data.get("short_url")
-            while not slug or Tinylink.objects.filter(short_url=slug):
-                slug = "".join(
-                    random.choice("abcdefghijkmnpqrstuvwxyz123456789")
-                    for x in range(getattr(settings, "TINYLINK_LENGTH", 6))
-                )
-            self.cleaned_data.update({"short_url": slug})
+            # Empty short URLs are allocated when the tinylink is saved.
+            pass
         else:
             if twin != self.instance:
                 self._errors["short_url"] = ErrorList(
@@ -164,4 +145,4 @@ class TinylinkAdminForm(forms.ModelForm):
 
     class Meta:
         model = Tinylink
-        fields = ("user", "long_url", "short_url")
+        fields = ("user", "long_url", "short_url", "cache_max_age")
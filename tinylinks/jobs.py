@@ -0,0 +1,55 @@
+"""Queued validations of long URLs for the ``django-tinylinks`` app."""
+from django.db import transaction
+from django.utils import timezone
+
+from tinylinks.checker import link_checker
+from tinylinks.models import Tinylink, ValidationJob
+
+
+def enqueue_validation(tinylinks, long_url_changed=False):
+    """
+    Queues the validation of ``tinylinks``.
+
+    A tinylink is queued only once. Queuing it again while it is checked
+    makes the worker check it another time. If ``long_url_changed`` is set,
+    the status of the tinylinks belongs to their old long URLs, so they are
+    marked as pending. New tinylinks are pending already.
+
+    """
+    tinylinks = list(tinylinks)
+    pks = [tinylink.pk for tinylink in tinylinks]
+    now = timezone.now()
+    with transaction.atomic():
+        if long_url_changed:
+            Tinylink.objects.filter(pk__in=pks).update(is_broken=None)
+        ValidationJob.objects.filter(tinylink__in=pks).update(enqueued=now)
+        ValidationJob.objects.bulk_create(
+            [ValidationJob(tinylink_id=pk, enqueued=now) for pk in pks],
+            ignore_conflicts=True,
+        )
+    if long_url_changed:
+        for tinylink in tinylinks:
+            tinylink.is_broken = None
+
+
+def process_validation_jobs(batch_size=100, checker=None):
+    """
+    Validates the tinylinks of up to ``batch_size`` queued jobs and returns
+    the number of processed jobs.
+
+    """
+    checker = checker or link_checker
+    started = timezone.now()
+    jobs = list(
+        ValidationJob.objects.select_related("tinylink").order_by("enqueued")[
+            :batch_size
+        ]
+    )
+    if not jobs:
+        return 0
+    checker.check([job.tinylink for job in jobs])
+    # Jobs queued again during the check stay in the queue.
+    ValidationJob.objects.filter(
+        pk__in=[job.pk for job in jobs], enqueued__lte=started
+    ).delete()
+    return len(jobs)
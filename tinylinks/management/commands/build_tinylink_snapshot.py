@@ -0,0 +1,37 @@
+"""
+Custom admin command to build the redirect snapshot.
+
+It writes all short URLs and their long URLs to the file defined by
+TINYLINK_SNAPSHOT_PATH. Running worker processes pick up the new snapshot
+within TINYLINK_SNAPSHOT_CHECK_INTERVAL seconds.
+
+"""
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from tinylinks.models import Tinylink
+from tinylinks.snapshot import write_snapshot
+
+
+class Command(BaseCommand):
+    """Class for the build_tinylink_snapshot admin command."""
+
+    help = "Builds the memory-mapped redirect snapshot."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--path",
+            help="Snapshot file, defaults to the TINYLINK_SNAPSHOT_PATH setting.",
+        )
+
+    def handle(self, *args, **options):
+        """Handles the build_tinylink_snapshot admin command."""
+        path = options["path"] or getattr(settings, "TINYLINK_SNAPSHOT_PATH", None)
+        if not path:
+            raise CommandError("Please set TINYLINK_SNAPSHOT_PATH or use --path.")
+        rows = (
+            Tinylink.objects.values_list("pk", "short_url", "long_url", "cache_max_age")
+            .order_by()
+            .iterator(chunk_size=10000)
+        )
+        count = write_snapshot(path, rows)
+        self.stdout.write("Wrote {} tinylinks to {}.".format(count, path))
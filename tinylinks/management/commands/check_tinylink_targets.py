@@ -1,34 +1,110 @@
 """
 Custom admin command to check all tinylink target URLs.
 
-It should check in a certain interval during a certain period defined in the
-settings by TINYLINK_CHECK_INTERVAL and TINYLINK_CHECK_PERIOD.
-After one period, all URLs should be checked for their availability.
+It should run every TINYLINK_CHECK_INTERVAL minutes. Each run checks the
+tinylinks whose next check is due. Popular tinylinks are checked more often
+than once per TINYLINK_CHECK_PERIOD, see ``tinylinks.scheduler``.
+The URLs of one run are checked concurrently, see ``LinkChecker``.
+
+Without ``--claim`` a run stops after TINYLINK_CHECK_INTERVAL minutes, once
+its current batch is checked, because the next run checks the same due
+tinylinks. With ``--claim`` the command claims batches of due tinylinks before
+checking them, so that it can run on several machines or overlap itself.
 
 """
+import time
+
 from django.conf import settings
 from django.core.management.base import BaseCommand
 from django.utils import timezone
-from tinylinks.models import Tinylink, validate_long_url
+from tinylinks.checker import LinkChecker, link_checker
+from tinylinks.scheduler import (
+    claim_due_tinylinks,
+    due_tinylinks,
+    release_tinylinks,
+)
 
 
 class Command(BaseCommand):
     """Class for the check_tinylink_targets admin command."""
 
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--concurrency",
+            type=int,
+            default=link_checker.concurrency,
+            help="Number of URLs checked at the same time.",
+        )
+        parser.add_argument(
+            "--per-host",
+            type=int,
+            default=link_checker.per_host,
+            help="Number of URLs of one host checked at the same time.",
+        )
+        parser.add_argument(
+            "--limit",
+            type=int,
+            help="Maximum number of URLs checked, the most overdue first.",
+        )
+        parser.add_argument(
+            "--claim",
+            action="store_true",
+            help="Claim the URLs, for several workers checking at once.",
+        )
+        parser.add_argument(
+            "--lease",
+            type=int,
+            default=getattr(settings, "TINYLINK_CHECK_LEASE", 600),
+            help="Seconds after which claimed URLs are released.",
+        )
+
+    def check_due(self, checker, limit):
+        links = due_tinylinks()
+        if limit:
+            links = links[:limit]
+        interval = getattr(settings, "TINYLINK_CHECK_INTERVAL", 10)
+        deadline = time.monotonic() + interval * 60
+        checked = 0
+        batch = []
+        for link in links.iterator(chunk_size=checker.batch_size):
+            batch.append(link)
+            if len(batch) == checker.batch_size:
+                checked += len(checker.check(batch))
+                batch = []
+                if time.monotonic() >= deadline:
+                    break
+        if batch:
+            checked += len(checker.check(batch))
+        return checked
+
+    def check_claimed(self, checker, limit, lease):
+        checked = 0
+        while not limit or checked < limit:
+            amount = checker.batch_size
+            if limit:
+                amount = min(amount, limit - checked)
+            links = claim_due_tinylinks(amount, lease=lease)
+            if not links:
+                break
+            checked += len(checker.check(links))
+            release_tinylinks(links)
+        return checked
+
     def handle(self, *args, **options):
         """Handles the check_tinylink_targets admin command."""
-        interval = settings.TINYLINK_CHECK_INTERVAL
-        period = settings.TINYLINK_CHECK_PERIOD
-        url_amount = Tinylink.objects.all().count()
-        check_amount = (url_amount / (period / interval)) or 1
-        for link in Tinylink.objects.order_by("last_checked")[:check_amount]:
-            validate_long_url(link)
-        print(
+        checker = LinkChecker(
+            concurrency=options["concurrency"],
+            per_host=options["per_host"],
+            breaker=link_checker.breaker,
+        )
+        if options["claim"]:
+            checked = self.check_claimed(checker, options["limit"], options["lease"])
+        else:
+            checked = self.check_due(checker, options["limit"])
+        self.stdout.write(
             "["
             + timezone.now().strftime("%d.%m.%Y - %H:%M")
             + "] Checked "
-            + str(check_amount)
-            + " of "
-            + str(url_amount)
-            + " total URLs."
+            + str(checked)
+            + " due URLs."
         )
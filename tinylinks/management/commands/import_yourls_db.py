@@ -4,8 +4,10 @@ from typing import List
 
 import mysql.connector
 from django.core.management.base import BaseCommand
+from tinylinks.bloom import announce_short_urls
+from tinylinks.cache import invalidate_short_urls
 from tinylinks.management.commands import _config, _queries
-from tinylinks.models import Tinylink, TinylinkLog
+from tinylinks.models import Tinylink, TinylinkLog, hash_long_url
 
 
 TINYLINK_QUERY = "SELECT url, keyword FROM yourls_url LIMIT %s, %s;"
@@ -28,10 +30,17 @@ class Command(BaseCommand):
         while data:
             print("Processing rows from {} to {}".format(start, start + self.chunk_length))
             tinylinks_to_add = [
-                Tinylink(long_url=long_url, short_url=shorturl)
+                Tinylink(
+                    long_url=long_url,
+                    long_url_hash=hash_long_url(long_url),
+                    short_url=shorturl,
+                )
                 for long_url, shorturl in data
             ]
             Tinylink.objects.bulk_create(tinylinks_to_add)
+            short_urls = [tinylink.short_url for tinylink in tinylinks_to_add]
+            invalidate_short_urls(short_urls)
+            announce_short_urls(short_urls)
             start += self.chunk_length
             data = self.get_tinylinks_query_data(start)
 
@@ -0,0 +1,127 @@
+"""
+Custom admin command to merge duplicate tinylinks.
+
+Tinylinks of the same user are duplicates if their long URLs are equal once
+canonicalized. The oldest tinylink of each group is kept. It receives the
+views and logs of its duplicates, which keep redirecting but are no longer
+found as brothers.
+
+"""
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, F, Min, Sum
+from tinylinks.models import Tinylink, TinylinkLog, hash_long_url
+
+
+class Command(BaseCommand):
+    """Class for the merge_duplicate_tinylinks admin command."""
+
+    help = "Merges tinylinks of the same user with equal canonical long URLs."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=1000,
+            help="Number of tinylinks rehashed per query.",
+        )
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Only count the duplicates.",
+        )
+
+    def rehash(self, batch_size):
+        """
+        Updates the hashes of tinylinks canonicalized differently before.
+
+        A tinylink whose new hash is already taken by another tinylink of the
+        same user is merged with that one right away, because the unique
+        constraint allows only one of them to keep the hash. Like in the
+        groups merged afterwards, the older tinylink is kept.
+
+        """
+        updated = 0
+        last_pk = 0
+        while True:
+            batch = list(
+                Tinylink.objects.filter(pk__gt=last_pk, long_url_hash__isnull=False)
+                .order_by("pk")
+                .only("pk", "user_id", "long_url", "long_url_hash")[:batch_size]
+            )
+            if not batch:
+                return updated
+            changed = {}
+            for tinylink in batch:
+                long_url_hash = hash_long_url(tinylink.long_url)
+                if tinylink.long_url_hash != long_url_hash:
+                    tinylink.long_url_hash = long_url_hash
+                    changed[tinylink.pk] = tinylink
+            holders = {
+                (user_id, long_url_hash): pk
+                for pk, user_id, long_url_hash in Tinylink.objects.filter(
+                    user__isnull=False,
+                    long_url_hash__in=[t.long_url_hash for t in changed.values()],
+                )
+                .exclude(pk__in=list(changed))
+                .values_list("pk", "user_id", "long_url_hash")
+            }
+            for tinylink in list(changed.values()):
+                if tinylink.user_id is None:
+                    continue
+                key = (tinylink.user_id, tinylink.long_url_hash)
+                holder_pk = holders.get(key)
+                if holder_pk is None:
+                    holders[key] = tinylink.pk
+                elif holder_pk < tinylink.pk:
+                    self.merge(holder_pk, [tinylink.pk])
+                    del changed[tinylink.pk]
+                else:
+                    # The newer holder gives up the hash before it is updated.
+                    self.merge(tinylink.pk, [holder_pk])
+                    holders[key] = tinylink.pk
+            Tinylink.objects.bulk_update(list(changed.values()), ["long_url_hash"])
+            updated += len(changed)
+            last_pk = batch[-1].pk
+
+    def merge(self, keep_pk, pks):
+        """Moves the views and logs of the tinylinks ``pks`` to ``keep_pk``."""
+        with transaction.atomic():
+            duplicates = Tinylink.objects.select_for_update().filter(pk__in=pks)
+            views = duplicates.aggregate(Sum("amount_of_views"))["amount_of_views__sum"]
+            TinylinkLog.objects.filter(tinylink_id__in=pks).update(tinylink_id=keep_pk)
+            duplicates.update(long_url_hash=None, amount_of_views=0)
+            Tinylink.objects.filter(pk=keep_pk).update(
+                amount_of_views=F("amount_of_views") + (views or 0)
+            )
+        return len(pks)
+
+    def handle(self, *args, **options):
+        """Handles the merge_duplicate_tinylinks admin command."""
+        if not options["dry_run"]:
+            updated = self.rehash(options["batch_size"])
+            self.stdout.write("Rehashed {} tinylinks.".format(updated))
+        groups = (
+            Tinylink.objects.filter(long_url_hash__isnull=False)
+            .values("user_id", "long_url_hash")
+            .annotate(count=Count("pk"), keep_pk=Min("pk"))
+            .filter(count__gt=1)
+            .order_by()
+        )
+        if options["dry_run"]:
+            duplicates = sum(group["count"] - 1 for group in groups)
+            self.stdout.write(
+                "Found {} duplicates, rehashing may find more.".format(duplicates)
+            )
+            return
+        merged = 0
+        for group in list(groups):
+            pks = (
+                Tinylink.objects.filter(
+                    user_id=group["user_id"], long_url_hash=group["long_url_hash"]
+                )
+                .exclude(pk=group["keep_pk"])
+                .values_list("pk", flat=True)
+            )
+            merged += self.merge(group["keep_pk"], list(pks))
+        self.stdout.write("Merged {} duplicate tinylinks.".format(merged))
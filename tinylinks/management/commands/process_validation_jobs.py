@@ -0,0 +1,49 @@
+"""
+Custom admin command to validate the long URLs of queued tinylinks.
+
+New tinylinks and the re-validate buttons queue a validation job instead of
+checking the long URL during the request. This worker drains the queue.
+
+"""
+import time
+
+from django.core.management.base import BaseCommand
+from tinylinks.jobs import process_validation_jobs
+
+
+class Command(BaseCommand):
+    """Class for the process_validation_jobs admin command."""
+
+    help = "Validates the long URLs of queued tinylinks."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=100,
+            help="Number of jobs processed at once.",
+        )
+        parser.add_argument(
+            "--sleep",
+            type=float,
+            default=5.0,
+            help="Seconds to wait for new jobs once the queue is empty.",
+        )
+        parser.add_argument(
+            "--once",
+            action="store_true",
+            help="Exit once the queue is empty.",
+        )
+
+    def handle(self, *args, **options):
+        """Handles the process_validation_jobs admin command."""
+        processed = 0
+        while True:
+            count = process_validation_jobs(options["batch_size"])
+            processed += count
+            if count:
+                continue
+            if options["once"]:
+                break
+            time.sleep(options["sleep"])
+        self.stdout.write("Processed {} validation jobs.".format(processed))
@@ -0,0 +1,189 @@
+"""Latency histograms of the redirect path of ``django-tinylinks``."""
+import os
+import socket
+import time
+from bisect import bisect_left
+from contextlib import contextmanager, nullcontext
+
+from django.conf import settings
+
+from tinylinks.buffers import BufferedWriter
+from tinylinks.cache import get_shared_cache
+
+WORKERS_KEY = "tinylinks:metrics:workers"
+
+# Upper bounds of the buckets in seconds, from 10 microseconds to about ten
+# seconds in steps of the square root of two. Slower samples are counted in
+# an extra bucket.
+BUCKETS = tuple(0.00001 * 2 ** (i / 2) for i in range(41))
+
+PERCENTILES = (("p50", 0.5), ("p95", 0.95), ("p99", 0.99))
+
+
+def get_worker_key(worker):
+    return "tinylinks:metrics:worker:{}".format(worker)
+
+
+class Histogram(object):
+    """
+    Counts durations in fixed buckets, so that histograms of several worker
+    processes can be added up.
+
+    """
+
+    def __init__(self, counts=None):
+        self.counts = list(counts or [0] * (len(BUCKETS) + 1))
+
+    def add(self, seconds):
+        self.counts[bisect_left(BUCKETS, seconds)] += 1
+
+    def merge(self, other):
+        for i, count in enumerate(other.counts):
+            self.counts[i] += count
+
+    def percentile(self, fraction):
+        """
+        Returns the upper bound of the bucket containing the given fraction
+        of all samples in seconds or ``None`` if the histogram is empty.
+
+        """
+        total = sum(self.counts)
+        if not total:
+            return None
+        cumulative = 0
+        for i, count in enumerate(self.counts):
+            cumulative += count
+            if cumulative >= fraction * total:
+                break
+        return BUCKETS[min(i, len(BUCKETS) - 1)]
+
+    def summary(self):
+        """Returns the sample count and the percentiles in milliseconds."""
+        summary = {"count": sum(self.counts)}
+        for name, fraction in PERCENTILES:
+            value = self.percentile(fraction)
+            summary[name] = None if value is None else round(value * 1000, 3)
+        return summary
+
+
+class LatencyRecorder(BufferedWriter):
+    """
+    Records the durations of the stages of a redirect in one ``Histogram``
+    per stage.
+
+    Every worker process publishes its histograms to the shared cache from a
+    background thread every ``publish_interval`` seconds, so that requests
+    never wait for the cache. ``collect`` reads them back.
+
+    :enabled: Disabled recorders don't measure anything.
+    :publish_interval: Seconds between two updates of the shared cache. ``0``
+      publishes on every sample.
+
+    """
+
+    def __init__(self, enabled, publish_interval=10):
+        super(LatencyRecorder, self).__init__(publish_interval)
+        self.enabled = enabled
+        self.publish_interval = publish_interval
+        self._histograms = {}
+
+    @property
+    def worker(self):
+        # Looked up on every call, because workers may be forked after import.
+        return "{}:{}".format(socket.gethostname(), os.getpid())
+
+    def time(self, stage):
+        """Returns a context manager which records its duration as ``stage``."""
+        if not self.enabled:
+            return nullcontext()
+        return self._time(stage)
+
+    @contextmanager
+    def _time(self, stage):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(stage, time.perf_counter() - start)
+
+    def add(self, stage, seconds):
+        with self._lock:
+            histogram = self._histograms.get(stage)
+            if histogram is None:
+                histogram = self._histograms[stage] = Histogram()
+            histogram.add(seconds)
+        if not self.interval:
+            self.publish()
+            return
+        self.start()
+
+    def get_counts(self):
+        with self._lock:
+            return {
+                stage: list(histogram.counts)
+                for stage, histogram in self._histograms.items()
+            }
+
+    def clear(self):
+        with self._lock:
+            self._histograms = {}
+
+    def flush(self):
+        if self.enabled:
+            self.publish()
+
+    def publish(self):
+        """Stores the histograms of this worker in the shared cache."""
+        shared_cache = get_shared_cache()
+        if shared_cache is None:
+            return
+        worker = self.worker
+        shared_cache.set(
+            get_worker_key(worker), self.get_counts(), self.publish_interval * 30
+        )
+        # Concurrent updates may drop a worker, it is added again on its next
+        # publication.
+        workers = shared_cache.get(WORKERS_KEY) or []
+        if worker not in workers:
+            shared_cache.set(WORKERS_KEY, workers + [worker], None)
+
+    def collect(self):
+        """
+        Returns the percentiles of each stage per worker and for all workers
+        together.
+
+        """
+        worker_counts = {}
+        shared_cache = get_shared_cache()
+        if shared_cache is not None:
+            workers = shared_cache.get(WORKERS_KEY) or []
+            worker_counts = shared_cache.get_many(
+                [get_worker_key(worker) for worker in workers]
+            )
+            worker_counts = {
+                worker: worker_counts[get_worker_key(worker)]
+                for worker in workers
+                if get_worker_key(worker) in worker_counts
+            }
+            if len(worker_counts) < len(workers):
+                # Forget workers which haven't published for a long time.
+                shared_cache.set(WORKERS_KEY, list(worker_counts), None)
+        worker_counts[self.worker] = self.get_counts()
+
+        result = {"workers": {}, "stages": {}}
+        totals = {}
+        for worker, counts in sorted(worker_counts.items()):
+            result["workers"][worker] = {}
+            for stage, stage_counts in counts.items():
+                histogram = Histogram(stage_counts)
+                result["workers"][worker][stage] = histogram.summary()
+                totals.setdefault(stage, Histogram()).merge(histogram)
+        for stage, histogram in totals.items():
+            result["stages"][stage] = histogram.summary()
+        return result
+
+
+latency_recorder = LatencyRecorder(
+    enabled=getattr(settings, "TINYLINK_LATENCY_METRICS", False),
+    publish_interval=getattr(settings, "TINYLINK_LATENCY_PUBLISH_INTERVAL", 10),
+)
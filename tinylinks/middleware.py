@@ -0,0 +1,69 @@
+"""Middlewares for the ``django-tinylinks`` app."""
+import re
+
+from django.urls import Resolver404, resolve, reverse
+
+from tinylinks.cache import RedirectCache, lookup_tinylink
+from tinylinks.metrics import latency_recorder
+from tinylinks.views import get_redirect_response, record_click
+
+short_url_pattern = re.compile(r"^[a-zA-Z0-9-]+$")
+
+
+class TinylinkRedirectMiddleware(object):
+    """
+    Serves tinylink redirects before the URL resolver and all following
+    middlewares run.
+
+    Put it on top of your ``MIDDLEWARE`` setting. Requests for existing
+    tinylinks are answered exactly like ``TinylinkRedirectView`` would answer
+    them, all other requests are passed on.
+
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.prefix = None
+        # Remembers whether the path of a known short URL is really routed to
+        # the redirect view and not shadowed by another URL pattern.
+        self.routed = RedirectCache(maxsize=4096, timeout=None)
+
+    def __call__(self, request):
+        if request.method in ("GET", "HEAD"):
+            response = self.process_redirect(request)
+            if response is not None:
+                return response
+        return self.get_response(request)
+
+    def process_redirect(self, request):
+        if self.prefix is None:
+            self.prefix = reverse("tinylink_redirect", kwargs={"short_url": "x"})[:-1]
+        path = request.path
+        if not path.startswith(self.prefix):
+            return None
+        short_url = path[len(self.prefix) :]
+        if not short_url_pattern.match(short_url):
+            return None
+
+        with latency_recorder.time("lookup"):
+            target = lookup_tinylink(short_url)
+        if target is None:
+            if not self.is_routed(request):
+                return None
+            return get_redirect_response(request, reverse("tinylink_notfound"))
+
+        routed = self.routed.get(short_url)
+        if routed is None:
+            routed = self.is_routed(request)
+            self.routed.set(short_url, routed)
+        if not routed:
+            return None
+        record_click(request, target.pk)
+        return get_redirect_response(request, target.long_url, target)
+
+    def is_routed(self, request):
+        try:
+            match = resolve(request.path_info)
+        except Resolver404:
+            return False
+        return match.url_name == "tinylink_redirect"
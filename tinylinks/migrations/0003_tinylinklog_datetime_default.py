@@ -0,0 +1,19 @@
+# Generated by Django 3.2.25 on 2026-10-18 09:25
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tinylinks', '0002_auto_20230407_0944'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='tinylinklog',
+            name='datetime',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+    ]
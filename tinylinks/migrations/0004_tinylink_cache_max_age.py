@@ -0,0 +1,18 @@
+# Generated by Django 3.2.25 on 2026-10-18 09:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tinylinks', '0003_tinylinklog_datetime_default'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='tinylink',
+            name='cache_max_age',
+            field=models.PositiveIntegerField(blank=True, null=True, verbose_name='Cache max age'),
+        ),
+    ]
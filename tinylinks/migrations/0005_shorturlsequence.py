@@ -0,0 +1,22 @@
+# Generated by Django 3.2.25 on 2026-10-18 09:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tinylinks', '0004_tinylink_cache_max_age'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ShortUrlSequence',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('length', models.PositiveSmallIntegerField(unique=True, verbose_name='Length')),
+                ('next_value', models.BigIntegerField(default=0, verbose_name='Next value')),
+                ('key', models.CharField(max_length=32, verbose_name='Key')),
+            ],
+        ),
+    ]
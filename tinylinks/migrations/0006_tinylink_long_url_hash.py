@@ -0,0 +1,59 @@
+# Generated by Django 3.2.25 on 2026-10-18 09:44
+
+import hashlib
+
+from django.db import migrations, models, transaction
+
+BATCH_SIZE = 1000
+
+
+def backfill_long_url_hash(apps, schema_editor):
+    # Every batch is committed on its own, so that big tables aren't locked
+    # for the whole migration.
+    Tinylink = apps.get_model('tinylinks', 'Tinylink')
+    last_pk = 0
+    while True:
+        batch = list(
+            Tinylink.objects.filter(pk__gt=last_pk)
+            .order_by('pk')
+            .only('pk', 'long_url')[:BATCH_SIZE]
+        )
+        if not batch:
+            break
+        for tinylink in batch:
+            tinylink.long_url_hash = hashlib.blake2b(
+                tinylink.long_url.encode('utf-8'), digest_size=16
+            ).hexdigest()
+        with transaction.atomic():
+            Tinylink.objects.bulk_update(batch, ['long_url_hash'])
+        last_pk = batch[-1].pk
+
+
+class Migration(migrations.Migration):
+
+    atomic = False
+
+    dependencies = [
+        ('tinylinks', '0005_shorturlsequence'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='tinylink',
+            name='long_url_hash',
+            field=models.CharField(editable=False, max_length=32, null=True, verbose_name='Long URL hash'),
+        ),
+        migrations.RunPython(backfill_long_url_hash, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='tinylink',
+            index=models.Index(fields=['user', 'long_url_hash'], name='tinylinks_t_user_id_258f54_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='tinylink',
+            index=models.Index(fields=['long_url_hash'], name='tinylinks_t_long_ur_4b43ad_idx'),
+        ),
+        migrations.RemoveIndex(
+            model_name='tinylink',
+            name='tinylinks_t_long_ur_99d4a0_idx',
+        ),
+    ]
@@ -0,0 +1,110 @@
+# Generated by Django 3.2.25 on 2026-10-18 09:47
+
+import hashlib
+import re
+from urllib.parse import urlsplit, urlunsplit
+
+from django.db import migrations, models, transaction
+from django.db.models import Count, Min
+
+BATCH_SIZE = 1000
+
+DEFAULT_PORTS = {'http': 80, 'https': 443, 'ftp': 21}
+
+UNRESERVED = frozenset(
+    'ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789-._~'
+)
+
+escape = re.compile(r'%[0-9a-fA-F]{2}')
+
+
+def _normalize_escape(match):
+    char = chr(int(match.group()[1:], 16))
+    if char in UNRESERVED:
+        return char
+    return match.group().upper()
+
+
+def canonicalize_url(url):
+    # A frozen copy of tinylinks.canonical.canonicalize_url, so that the
+    # migration always calculates the same hashes. Custom canonicalizers are
+    # applied by the merge_duplicate_tinylinks command.
+    url = url.strip()
+    try:
+        parts = urlsplit(url)
+        port = parts.port
+    except ValueError:
+        return url
+    if not parts.scheme or not parts.hostname:
+        return url
+    scheme = parts.scheme.lower()
+    netloc = parts.hostname.rstrip('.')
+    if ':' in netloc:
+        netloc = '[{}]'.format(netloc)
+    if port is not None and port != DEFAULT_PORTS.get(scheme):
+        netloc = '{}:{}'.format(netloc, port)
+    if '@' in parts.netloc:
+        netloc = '{}@{}'.format(parts.netloc.rsplit('@', 1)[0], netloc)
+    path = escape.sub(_normalize_escape, parts.path).rstrip('/') or '/'
+    query = escape.sub(_normalize_escape, parts.query)
+    query = '&'.join(sorted(param for param in query.split('&') if param))
+    return urlunsplit((scheme, netloc, path, query, parts.fragment))
+
+
+def hash_long_url(long_url):
+    return hashlib.blake2b(
+        canonicalize_url(long_url).encode('utf-8'), digest_size=16
+    ).hexdigest()
+
+
+def rehash_long_urls(apps, schema_editor):
+    # The hashes are calculated over the canonical long URLs now.
+    Tinylink = apps.get_model('tinylinks', 'Tinylink')
+    last_pk = 0
+    while True:
+        batch = list(
+            Tinylink.objects.filter(pk__gt=last_pk)
+            .order_by('pk')
+            .only('pk', 'long_url', 'long_url_hash')[:BATCH_SIZE]
+        )
+        if not batch:
+            break
+        for tinylink in batch:
+            tinylink.long_url_hash = hash_long_url(tinylink.long_url)
+        with transaction.atomic():
+            Tinylink.objects.bulk_update(batch, ['long_url_hash'])
+        last_pk = batch[-1].pk
+
+
+def clear_duplicate_hashes(apps, schema_editor):
+    # Only the oldest tinylink of a user is found by its long URL.
+    Tinylink = apps.get_model('tinylinks', 'Tinylink')
+    duplicates = (
+        Tinylink.objects.filter(user__isnull=False, long_url_hash__isnull=False)
+        .values('user_id', 'long_url_hash')
+        .annotate(count=Count('pk'), keep_pk=Min('pk'))
+        .filter(count__gt=1)
+        .order_by()
+    )
+    for group in list(duplicates):
+        Tinylink.objects.filter(
+            user_id=group['user_id'], long_url_hash=group['long_url_hash']
+        ).exclude(pk=group['keep_pk']).update(long_url_hash=None)
+
+
+class Migration(migrations.Migration):
+
+    atomic = False
+
+    dependencies = [
+        ('tinylinks', '0006_tinylink_long_url_hash'),
+    ]
+
+    operations = [
+        migrations.RunPython(rehash_long_urls, migrations.RunPython.noop),
+        migrations.RunPython(clear_duplicate_hashes, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='tinylink',
+            constraint=models.UniqueConstraint(fields=('user', 'long_url_hash'), name='tinylinks_unique_long_url'),
+        ),
+    ]
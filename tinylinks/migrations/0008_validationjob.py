@@ -0,0 +1,28 @@
+# Generated by Django 3.2.25 on 2026-10-18 09:51
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tinylinks', '0007_tinylink_unique_long_url'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='tinylink',
+            name='is_broken',
+            field=models.BooleanField(default=None, null=True, verbose_name='Status'),
+        ),
+        migrations.CreateModel(
+            name='ValidationJob',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('enqueued', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Enqueued')),
+                ('tinylink', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='validation_job', to='tinylinks.tinylink', verbose_name='Tinylink')),
+            ],
+        ),
+    ]
@@ -0,0 +1,48 @@
+# Generated by Django 3.2.25 on 2026-10-18 09:55
+
+import datetime
+
+from django.conf import settings
+from django.db import migrations, models, transaction
+from django.db.models import F, Max
+import django.utils.timezone
+
+BATCH_SIZE = 10000
+
+
+def schedule_checks(apps, schema_editor):
+    # Keep the order of the old scheduler instead of making every tinylink
+    # due at once.
+    Tinylink = apps.get_model('tinylinks', 'Tinylink')
+    period = datetime.timedelta(
+        minutes=getattr(settings, 'TINYLINK_CHECK_PERIOD', 300)
+    )
+    max_pk = Tinylink.objects.aggregate(Max('pk'))['pk__max'] or 0
+    for start in range(0, max_pk, BATCH_SIZE):
+        batch = Tinylink.objects.filter(pk__gt=start, pk__lte=start + BATCH_SIZE)
+        with transaction.atomic():
+            batch.update(next_check=F('last_checked') + period)
+            batch.filter(is_broken=True).update(check_failures=1)
+
+
+class Migration(migrations.Migration):
+
+    atomic = False
+
+    dependencies = [
+        ('tinylinks', '0008_validationjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='tinylink',
+            name='check_failures',
+            field=models.PositiveSmallIntegerField(default=0, verbose_name='Failed validations'),
+        ),
+        migrations.AddField(
+            model_name='tinylink',
+            name='next_check',
+            field=models.DateTimeField(db_index=True, default=django.utils.timezone.now, verbose_name='Next validation'),
+        ),
+        migrations.RunPython(schedule_checks, migrations.RunPython.noop),
+    ]
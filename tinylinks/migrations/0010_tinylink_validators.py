@@ -0,0 +1,23 @@
+# Generated by Django 3.2.25 on 2026-10-18 09:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tinylinks', '0009_tinylink_next_check'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='tinylink',
+            name='etag',
+            field=models.CharField(blank=True, default='', max_length=255, verbose_name='ETag'),
+        ),
+        migrations.AddField(
+            model_name='tinylink',
+            name='last_modified',
+            field=models.CharField(blank=True, default='', max_length=64, verbose_name='Last modified'),
+        ),
+    ]
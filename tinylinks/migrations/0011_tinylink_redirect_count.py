@@ -0,0 +1,18 @@
+# Generated by Django 3.2.25 on 2026-10-18 09:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tinylinks', '0010_tinylink_validators'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='tinylink',
+            name='redirect_count',
+            field=models.PositiveSmallIntegerField(default=0, verbose_name='Redirects'),
+        ),
+    ]
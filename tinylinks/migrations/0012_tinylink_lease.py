@@ -0,0 +1,23 @@
+# Generated by Django 3.2.25 on 2026-10-18 09:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tinylinks', '0011_tinylink_redirect_count'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='tinylink',
+            name='lease_owner',
+            field=models.CharField(blank=True, default='', editable=False, max_length=32, verbose_name='Claimed by'),
+        ),
+        migrations.AddField(
+            model_name='tinylink',
+            name='lease_until',
+            field=models.DateTimeField(blank=True, editable=False, null=True, verbose_name='Claimed until'),
+        ),
+    ]
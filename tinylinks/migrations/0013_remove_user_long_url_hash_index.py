@@ -0,0 +1,17 @@
+# Generated by Django 3.2.25 on 2026-10-18 10:39
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tinylinks', '0012_tinylink_lease'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='tinylink',
+            name='tinylinks_t_user_id_258f54_idx',
+        ),
+    ]
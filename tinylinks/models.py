@@ -1,28 +1,51 @@
 """Models for the ``django-tinylinks`` app."""
+import hashlib
 import socket
-from http.cookiejar import CookieJar
-from urllib.request import HTTPCookieProcessor, Request, build_opener, urlopen
 
 from django.conf import settings
 from django.contrib.auth import get_user_model
-from django.db import models
+from django.db import IntegrityError, models, transaction
 from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
-from urllib3 import PoolManager
 from urllib3.exceptions import HTTPError, MaxRetryError, TimeoutError
 
+from tinylinks.canonical import get_canonical_url
+from tinylinks.client import (
+    RedirectLoop,
+    TooManyRedirects,
+    follow_redirects,
+    link_client,
+    open_url,
+)
+
 User = get_user_model()
 
 
-def get_url_response(pool, link, url):
+def hash_long_url(long_url):
+    """
+    Returns the fixed-width digest used to look up tinylinks by long URL.
+
+    Long URLs which are equal once canonicalized have the same digest.
+
+    """
+    long_url = get_canonical_url(long_url)
+    return hashlib.blake2b(long_url.encode("utf-8"), digest_size=16).hexdigest()
+
+
+def get_url_response(pool, link, url, headers=None):
     """
     Function to open and check an URL. In case of failure it sets the relevant
-    validation error.
+    validation error. Only the status and the headers are downloaded, see
+    ``open_url``. Redirects are followed, the last URL and the number of
+    redirects are set on ``link``. ``link.host_unreachable`` is set if no
+    response could be received.
 
     """
     response = False
     link.is_broken = True
+    link.host_unreachable = False
     link.redirect_location = ""
+    link.redirect_count = 0
     # Try to encode e.g. chinese letters
     try:
         url = url.encode("utf-8")
@@ -30,58 +53,89 @@ def get_url_response(pool, link, url):
         link.validation_error = _("Unicode error. Check URL characters.")
         return False
     try:
-        response = pool.urlopen("GET", url.decode(), retries=2, timeout=8.0)
+        response, final_url, hops = follow_redirects(
+            pool,
+            url.decode(),
+            headers=headers,
+            max_redirects=getattr(settings, "TINYLINK_CHECK_MAX_REDIRECTS", 10),
+            retries=2,
+            timeout=8.0,
+        )
     except TimeoutError:
         link.validation_error = _("Timeout after 8 seconds.")
+        link.host_unreachable = True
     except MaxRetryError:
         link.validation_error = _("Failed after retrying twice.")
+        link.host_unreachable = True
     except (HTTPError, socket.gaierror):
         link.validation_error = _("Not found.")
+        link.host_unreachable = True
+    except TooManyRedirects:
+        link.validation_error = _("Too many redirects.")
+    except RedirectLoop:
+        link.validation_error = _("Redirect loop.")
+    else:
+        if hops:
+            link.redirect_location = final_url[:2500]
+            link.redirect_count = hops
     return response
 
 
-def validate_long_url(link):
+def get_conditional_headers(link):
+    """
+    Returns the headers which let the server of a healthy long URL answer
+    with "304 Not Modified" if it didn't change since the last check.
+
     """
-    Function to validate a URL. The validator uses urllib3 to test the URL's
-    availability.
+    headers = {}
+    if link.is_broken is False:
+        if link.etag:
+            headers["If-None-Match"] = link.etag
+        if link.last_modified:
+            headers["If-Modified-Since"] = link.last_modified
+    return headers
+
+
+def check_long_url(link):
+    """
+    Function to check a URL. The checker uses urllib3 to test the URL's
+    availability and sets the result on ``link`` without saving it. All
+    requests share the connections of ``link_client``.
 
     """
-    http = PoolManager()
-    response = get_url_response(http, link, link.long_url)
-    if response and response.status == 200:
+    http = link_client.pool
+    response = get_url_response(
+        http, link, link.long_url, headers=get_conditional_headers(link)
+    )
+    if response and response.status == 304:
+        # The target didn't change since its last successful check.
         link.is_broken = False
-    elif response and response.status == 302:
-        # If link is redirected, validate the redirect location.
-        if link.long_url.endswith(".pdf"):
-            # Non-save pdf exception, to avoid relative path redirects
-            link.is_broken = False
-        else:
-            redirect_location = response.get_redirect_location()
-            redirect = get_url_response(http, link, redirect_location)
-            link.redirect_location = redirect_location
-            if redirect.status == 200:
-                link.is_broken = False
-            elif redirect.status == 302:
-                # Seems like an infinite loop. Maybe the server is looking for
-                # a cookie?
-                cj = CookieJar()
-                opener = build_opener(HTTPCookieProcessor(cj))
-                request = Request(response.get_redirect_location())
-                response = opener.open(request)
-                if response.code == 200:
-                    link.is_broken = False
+    elif response and response.status == 200:
+        link.is_broken = False
+        link.etag = response.headers.get("ETag", "")[:255]
+        link.last_modified = response.headers.get("Last-Modified", "")[:64]
     elif response and response.status == 502:
         # Sometimes urllib3 repond with a 502er. Those pages might respond with
-        # a 200er in the Browser, so re-check with urllib2
+        # a 200er in the Browser, so re-check once more with a GET request.
+        url = link.redirect_location or link.long_url
         try:
-            response = urlopen(link.long_url, timeout=8.0)
-        except HTTPError:
+            response = open_url(http, url, method="GET", timeout=8.0)
+        except (HTTPError, socket.error):
             link.validation_error = _("URL not accessible.")
         else:
-            link.is_broken = False
-    else:
+            if response.status < 400:
+                link.is_broken = False
+            else:
+                link.validation_error = _("URL not accessible.")
+    elif response:
         link.validation_error = _("URL not accessible.")
     link.last_checked = timezone.now()
+    return link
+
+
+def validate_long_url(link):
+    """Function to check a URL and save the result."""
+    check_long_url(link)
     link.save()
     return link
 
@@ -92,12 +146,32 @@ class Tinylink(models.Model):
 
     :user: The author of the tinylink.
     :long_url: Long URL version.
-    :short_url: Shortened URL.
-    :is_broken: Set if the given long URL couldn't be validated.
+    :long_url_hash: Digest of the canonical long URL, set on save when the
+      long URL changes. Look up tinylinks by long URL with ``hash_long_url``
+      to use its index. It is unique per user, further tinylinks of the user
+      with the same long URL and merged duplicates don't have one.
+    :short_url: Shortened URL. A unique one is allocated on save if it is
+      empty.
+    :is_broken: Set if the given long URL couldn't be validated. ``None``
+      while the long URL waits for its validation.
     :validation_error: Description of the occurred error.
     :last_checked: Datetime of the last validation process.
+    :check_failures: Number of validations in a row which found the long URL
+      broken.
+    :next_check: Datetime from which the long URL is due for its next
+      validation, see ``tinylinks.scheduler``.
+    :lease_until: Datetime until which a check worker has claimed the
+      tinylink.
+    :lease_owner: Random token of the claim.
     :amount_of_views: Field to count the redirect views.
-    :redirect_location: Redirect location if the long_url is redirected.
+    :redirect_location: Last URL of the redirects of the long URL, empty if
+      it isn't redirected.
+    :redirect_count: Number of redirects of the long URL.
+    :etag: ``ETag`` of the long URL at its last successful validation.
+    :last_modified: ``Last-Modified`` of the long URL at its last successful
+      validation.
+    :cache_max_age: Seconds CDNs may cache the redirect, overrides the
+      ``TINYLINK_REDIRECT_SHARED_MAX_AGE`` setting.
 
     """
 
@@ -115,6 +189,13 @@ class Tinylink(models.Model):
         verbose_name=_("Long URL"),
     )
 
+    long_url_hash = models.CharField(
+        max_length=32,
+        null=True,
+        editable=False,
+        verbose_name=_("Long URL hash"),
+    )
+
     short_url = models.CharField(
         max_length=32,
         verbose_name=_("Short URL"),
@@ -122,7 +203,8 @@ class Tinylink(models.Model):
     )
 
     is_broken = models.BooleanField(
-        default=False,
+        null=True,
+        default=None,
         verbose_name=_("Status"),
     )
 
@@ -137,6 +219,32 @@ class Tinylink(models.Model):
         verbose_name=_("Last validation"),
     )
 
+    check_failures = models.PositiveSmallIntegerField(
+        default=0,
+        verbose_name=_("Failed validations"),
+    )
+
+    next_check = models.DateTimeField(
+        default=timezone.now,
+        db_index=True,
+        verbose_name=_("Next validation"),
+    )
+
+    lease_until = models.DateTimeField(
+        null=True,
+        blank=True,
+        editable=False,
+        verbose_name=_("Claimed until"),
+    )
+
+    lease_owner = models.CharField(
+        max_length=32,
+        blank=True,
+        default="",
+        editable=False,
+        verbose_name=_("Claimed by"),
+    )
+
     amount_of_views = models.PositiveIntegerField(
         default=0,
         verbose_name=_("Amount of views"),
@@ -148,6 +256,107 @@ class Tinylink(models.Model):
         default="",
     )
 
+    redirect_count = models.PositiveSmallIntegerField(
+        default=0,
+        verbose_name=_("Redirects"),
+    )
+
+    etag = models.CharField(
+        max_length=255,
+        blank=True,
+        default="",
+        verbose_name=_("ETag"),
+    )
+
+    last_modified = models.CharField(
+        max_length=64,
+        blank=True,
+        default="",
+        verbose_name=_("Last modified"),
+    )
+
+    cache_max_age = models.PositiveIntegerField(
+        null=True,
+        blank=True,
+        verbose_name=_("Cache max age"),
+    )
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super(Tinylink, cls).from_db(db, field_names, values)
+        # Remember the stored URLs, max age and user to be able to invalidate
+        # caches and to find brothers, once they get changed.
+        instance._loaded_short_url = instance.__dict__.get("short_url")
+        instance._loaded_long_url = instance.__dict__.get("long_url")
+        instance._loaded_cache_max_age = instance.__dict__.get("cache_max_age")
+        instance._loaded_user_id = instance.__dict__.get("user_id")
+        return instance
+
+    def save(self, *args, **kwargs):
+        hashed = False
+        if "long_url" in self.__dict__ and (
+            self._state.adding
+            or self.long_url != getattr(self, "_loaded_long_url", None)
+        ):
+            self.long_url_hash = hash_long_url(self.long_url)
+            # The validators belong to the old long URL.
+            self.etag = ""
+            self.last_modified = ""
+            hashed = True
+        elif "user_id" in self.__dict__ and self.user_id != getattr(
+            self, "_loaded_user_id", self.user_id
+        ):
+            # The new user might have a tinylink for the long URL already or
+            # none at all.
+            self.long_url_hash = hash_long_url(self.long_url)
+            hashed = True
+        # Only one tinylink per user is found by its long URL, others with the
+        # same long URL just redirect.
+        if hashed and self._has_brother():
+            self.long_url_hash = None
+        unique_hash = hashed and self.user_id is not None and self.long_url_hash
+        allocate = not self.short_url
+        if not allocate and not unique_hash:
+            return super(Tinylink, self).save(*args, **kwargs)
+        # Allocate a short URL, skipping the ones which have been chosen by
+        # hand or by the random generator of earlier versions.
+        from tinylinks.allocator import short_url_allocator
+
+        if allocate:
+            self.short_url = short_url_allocator.allocate()
+        while True:
+            try:
+                with transaction.atomic():
+                    return super(Tinylink, self).save(*args, **kwargs)
+            except IntegrityError:
+                if unique_hash and self._has_brother():
+                    # Another tinylink of the user got the long URL in the
+                    # meantime.
+                    self.long_url_hash = None
+                elif (
+                    allocate
+                    and Tinylink.objects.filter(short_url=self.short_url).exists()
+                ):
+                    self.short_url = short_url_allocator.allocate()
+                else:
+                    raise
+
+    def _has_brother(self):
+        """
+        Returns ``True`` if another tinylink of the user is found by the long
+        URL of this one.
+
+        """
+        if self.user_id is None or self.long_url_hash is None:
+            return False
+        return (
+            Tinylink.objects.filter(
+                user_id=self.user_id, long_url_hash=self.long_url_hash
+            )
+            .exclude(pk=self.pk)
+            .exists()
+        )
+
     def get_short_url(self) -> str:
         return "/".join(
             [getattr(settings, "TINYLINK_SHORT_URL_PREFIX", ""), str(self.short_url)]
@@ -160,7 +369,12 @@ class Tinylink(models.Model):
         ordering = ["-id"]
         indexes = [
             models.Index(fields=["short_url"]),
-            models.Index(fields=["long_url"]),
+            models.Index(fields=["long_url_hash"]),
+        ]
+        constraints = [
+            models.UniqueConstraint(
+                fields=["user", "long_url_hash"], name="tinylinks_unique_long_url"
+            ),
         ]
 
     def can_be_validated(self):
@@ -203,9 +417,57 @@ class TinylinkLog(models.Model):
 
     remote_ip = models.GenericIPAddressField()
 
-    datetime = models.DateTimeField(auto_now_add=True)
+    datetime = models.DateTimeField(default=timezone.now)
 
     tracked = models.BooleanField(default=False)
 
     class Meta:
         ordering = ("-datetime",)
+
+
+class ShortUrlSequence(models.Model):
+    """
+    Sequence of the automatically allocated short URLs of one length.
+
+    :length: Length of the short URLs.
+    :next_value: Next unused value of the sequence.
+    :key: Secret key of the permutation which turns values into short URLs.
+
+    """
+
+    length = models.PositiveSmallIntegerField(
+        unique=True,
+        verbose_name=_("Length"),
+    )
+
+    next_value = models.BigIntegerField(
+        default=0,
+        verbose_name=_("Next value"),
+    )
+
+    key = models.CharField(
+        max_length=32,
+        verbose_name=_("Key"),
+    )
+
+
+class ValidationJob(models.Model):
+    """
+    Queued validation of the long URL of a tinylink.
+
+    :tinylink: The tinylink to validate.
+    :enqueued: Datetime of the latest request to validate the tinylink.
+
+    """
+
+    tinylink = models.OneToOneField(
+        "Tinylink",
+        verbose_name=_("Tinylink"),
+        related_name="validation_job",
+        on_delete=models.CASCADE,
+    )
+
+    enqueued = models.DateTimeField(
+        default=timezone.now,
+        verbose_name=_("Enqueued"),
+    )
@@ -0,0 +1,159 @@
+"""Scheduling of long URL checks for the ``django-tinylinks`` app."""
+import datetime
+import math
+import uuid
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Count, Exists, OuterRef, Q
+from django.utils import timezone
+
+from tinylinks.models import Tinylink, TinylinkLog, ValidationJob
+
+# Fields of the tinylinks needed to check and schedule them.
+CHECK_ONLY = [
+    "pk",
+    "long_url",
+    "is_broken",
+    "validation_error",
+    "redirect_location",
+    "redirect_count",
+    "etag",
+    "last_modified",
+    "last_checked",
+    "amount_of_views",
+    "check_failures",
+    "next_check",
+]
+
+# Days whose clicks make a tinylink popular.
+RECENT_DAYS = 7
+
+# Longest interval between two checks, as a multiple of the check period.
+MAX_PERIODS = 8
+
+
+def get_check_interval(link, recent_clicks=0):
+    """
+    Returns the time until the next check of ``link``.
+
+    Tinylinks are checked once per ``TINYLINK_CHECK_PERIOD``. Recently
+    clicked tinylinks are checked more often, the more clicks the more often,
+    but at most once per ``TINYLINK_CHECK_INTERVAL``. Tinylinks which were
+    never clicked are checked half as often. Broken tinylinks are checked
+    again after one interval, which doubles with every further failure.
+
+    """
+    interval = datetime.timedelta(
+        minutes=getattr(settings, "TINYLINK_CHECK_INTERVAL", 10)
+    )
+    period = datetime.timedelta(minutes=getattr(settings, "TINYLINK_CHECK_PERIOD", 300))
+    if link.check_failures:
+        backoff = interval * 2 ** min(link.check_failures - 1, 16)
+        return min(backoff, period * MAX_PERIODS)
+    if recent_clicks:
+        return max(period / (1 + math.log2(1 + recent_clicks)), interval)
+    if not link.amount_of_views:
+        return period * 2
+    return period
+
+
+def schedule_checks(links, now=None):
+    """
+    Sets ``check_failures`` and ``next_check`` of the checked ``links``.
+
+    The recent clicks of all links are counted with one query.
+
+    """
+    now = now or timezone.now()
+    since = now - datetime.timedelta(days=RECENT_DAYS)
+    recent_clicks = dict(
+        TinylinkLog.objects.filter(
+            tinylink__in=[link.pk for link in links], datetime__gte=since
+        )
+        .values_list("tinylink")
+        .annotate(Count("pk"))
+        .order_by()
+    )
+    for link in links:
+        if link.is_broken:
+            link.check_failures += 1
+        else:
+            link.check_failures = 0
+        link.next_check = now + get_check_interval(link, recent_clicks.get(link.pk, 0))
+    return links
+
+
+def due_tinylinks(now=None):
+    """
+    Returns the tinylinks due for a check, the most overdue first.
+
+    Tinylinks claimed by a worker are left out until their lease expires.
+    Tinylinks with a queued validation are left out, too. Checking them
+    schedules their next check.
+
+    """
+    now = now or timezone.now()
+    queued = ValidationJob.objects.filter(tinylink=OuterRef("pk"))
+    return (
+        Tinylink.objects.filter(next_check__lte=now)
+        .filter(Q(lease_until__isnull=True) | Q(lease_until__lt=now))
+        .filter(~Exists(queued))
+        .order_by("next_check")
+        .only(*CHECK_ONLY)
+    )
+
+
+def claim_due_tinylinks(amount, lease=600, now=None):
+    """
+    Claims up to ``amount`` due tinylinks for ``lease`` seconds and returns
+    them.
+
+    Other workers don't receive the claimed tinylinks until they are checked
+    or the lease expires, e.g. because the worker died. Databases which
+    support it lock the due rows with ``SKIP LOCKED``, so that workers don't
+    wait for each other. Elsewhere only the rows which are still unclaimed
+    when the lease is written are claimed.
+
+    """
+    now = now or timezone.now()
+    owner = uuid.uuid4().hex
+    lease_until = now + datetime.timedelta(seconds=lease)
+    while True:
+        due = due_tinylinks(now)
+        with transaction.atomic():
+            if connection.features.has_select_for_update_skip_locked:
+                due = due.select_for_update(skip_locked=True)
+            pks = list(due.values_list("pk", flat=True)[:amount])
+            # Other workers may have claimed some of the rows meanwhile.
+            claimed = (
+                due_tinylinks(now)
+                .filter(pk__in=pks)
+                .update(lease_until=lease_until, lease_owner=owner)
+            )
+        # If other workers took all rows, they aren't due anymore and the
+        # next ones are tried.
+        if claimed or not pks:
+            break
+    claimed = Tinylink.objects.filter(pk__in=pks, lease_owner=owner)
+    return list(claimed.order_by("next_check").only(*CHECK_ONLY, "lease_owner"))
+
+
+def release_tinylinks(links):
+    """
+    Ends the claims of the checked ``links``.
+
+    Only the leases the claiming worker still holds are removed. If a lease
+    expired and another worker claimed the tinylink meanwhile, its lease is
+    kept.
+
+    """
+    pks_by_owner = defaultdict(list)
+    for link in links:
+        if link.lease_owner:
+            pks_by_owner[link.lease_owner].append(link.pk)
+    for owner, pks in pks_by_owner.items():
+        Tinylink.objects.filter(pk__in=pks, lease_owner=owner).update(
+            lease_until=None, lease_owner=""
+        )
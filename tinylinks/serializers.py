@@ -2,16 +2,28 @@ from urllib.parse import urlparse
 
 from django.conf import settings
 from django.contrib.auth import get_user_model
-from django.utils.crypto import get_random_string
 from django.utils.translation import gettext_lazy as _
 from rest_framework import serializers
 
 from tinylinks.detaults import DEFAULT_ALLOWED_URL_SCHEMES
 from tinylinks.models import Tinylink
+from tinylinks.upsert import upsert_tinylink, upsert_tinylinks
 
 User = get_user_model()
 
 
+def validate_url_scheme(value):
+    url = urlparse(value)
+    schemes = getattr(
+        settings, "TINYLINK_ALLOWED_URL_SCHEMES", DEFAULT_ALLOWED_URL_SCHEMES
+    )
+    if url.scheme not in schemes:
+        raise serializers.ValidationError(
+            _(f"URL scheme must be one of the following: {','.join(schemes)}")
+        )
+    return value
+
+
 class UserSerializer(serializers.ModelSerializer):
     tinylinks = serializers.PrimaryKeyRelatedField(
         many=True, queryset=User.objects.all()
@@ -28,18 +40,12 @@ class TinylinkSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Tinylink
-        fields = ("id", "user", "long_url", "short_url")
+        fields = ("id", "user", "long_url", "short_url", "cache_max_age")
 
     def validate_long_url(self, value):
-        url = urlparse(value)
-        schemes = getattr(
-            settings, "TINYLINK_ALLOWED_URL_SCHEMES", DEFAULT_ALLOWED_URL_SCHEMES
-        )
-        if url.scheme not in schemes:
-            raise serializers.ValidationError(
-                _(f"URL scheme must be one of the following: {','.join(schemes)}")
-            )
-        return value
+        # The canonical URL is only used to find brothers, the long URL is
+        # stored as it is.
+        return validate_url_scheme(value)
 
     def create(self, validated_data):
         user = self.context.get("user", None)
@@ -49,20 +55,60 @@ class TinylinkSerializer(serializers.ModelSerializer):
                 user = request.user
         if user and user.is_anonymous:
             user = None
-        brothers = Tinylink.objects.filter(
-            long_url=validated_data["long_url"], user=user
-        )
-        if brothers:
-            return brothers[0]
+        tinylink, created = upsert_tinylink(validated_data["long_url"], user)
+        if (
+            "cache_max_age" in validated_data
+            and validated_data["cache_max_age"] != tinylink.cache_max_age
+        ):
+            tinylink.cache_max_age = validated_data["cache_max_age"]
+            tinylink.save(update_fields=["cache_max_age"])
+        return tinylink
+
+
+class TinylinkBulkSerializer(serializers.Serializer):
+    long_urls = serializers.ListField(
+        child=serializers.CharField(max_length=2500, validators=[validate_url_scheme]),
+        allow_empty=False,
+    )
 
-        slug = None
-        while not slug or Tinylink.objects.filter(short_url=slug):
-            slug = get_random_string(getattr(settings, "TINYLINK_LENGTH", 6))
+    def validate_long_urls(self, value):
+        # The setting is read per request, so that it can be changed at runtime.
+        max_length = getattr(settings, "TINYLINK_BULK_MAX_SIZE", 10000)
+        if len(value) > max_length:
+            raise serializers.ValidationError(
+                _("Ensure this field has no more than {max_length} elements.").format(
+                    max_length=max_length
+                )
+            )
+        return value
+
+    def create(self, validated_data):
+        """
+        Returns a dictionary of all long URLs and their tinylinks in the
+        order of the request.
+
+        Existing tinylinks of the user are reused, the others are created
+        with one ``bulk_create``.
 
-        validated_data["user"] = user
-        validated_data["short_url"] = slug
-        instance = super().create(validated_data)
-        return instance
+        """
+        user = self.context["request"].user
+        if user.is_anonymous:
+            user = None
+        tinylinks, created = upsert_tinylinks(validated_data["long_urls"], user)
+        return tinylinks
+
+
+class ClickSerializer(serializers.Serializer):
+    short_url = serializers.CharField(max_length=32)
+    referrer = serializers.CharField(
+        max_length=512, required=False, allow_blank=True, default=""
+    )
+    user_agent = serializers.CharField(required=False, allow_blank=True, default="")
+    cookie = serializers.CharField(
+        max_length=127, required=False, allow_blank=True, default=""
+    )
+    remote_ip = serializers.IPAddressField()
+    datetime = serializers.DateTimeField(required=False)
 
 
 # class TinylinkSerializer(serializers.Serializer):
@@ -0,0 +1,29 @@
+"""Signal handlers for the ``django-tinylinks`` app."""
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from tinylinks.bloom import announce_short_url
+from tinylinks.cache import invalidate_tinylink, purge_tinylink
+from tinylinks.models import Tinylink
+
+
+@receiver(post_save, sender=Tinylink)
+def tinylink_saved(sender, instance, created, **kwargs):
+    """Drops cached redirect targets of a created or changed tinylink."""
+    invalidate_tinylink(instance)
+    purge_tinylink(instance)
+    if created:
+        announce_short_url(instance.short_url)
+    elif instance.short_url != getattr(instance, "_loaded_short_url", None):
+        announce_short_url(instance.short_url, renamed=True)
+    instance._loaded_short_url = instance.short_url
+    instance._loaded_long_url = instance.long_url
+    instance._loaded_cache_max_age = instance.__dict__.get("cache_max_age")
+    instance._loaded_user_id = instance.__dict__.get("user_id")
+
+
+@receiver(post_delete, sender=Tinylink)
+def tinylink_deleted(sender, instance, **kwargs):
+    """Drops cached redirect targets of a deleted tinylink."""
+    invalidate_tinylink(instance, deleted=True)
+    purge_tinylink(instance, deleted=True)
@@ -0,0 +1,227 @@
+"""
+Memory-mapped redirect snapshots for the ``django-tinylinks`` app.
+
+A snapshot is an immutable binary file containing all redirect targets. All
+worker processes map the same file, so they share one copy of it in the page
+cache.
+
+The file starts with a header, followed by the records and an index sorted by
+the hash of the short URLs. The generation is the build time in nanoseconds
+since the epoch::
+
+    header: magic, generation, record count, index offset
+    record: primary key, cache max age, short URL length, long URL length,
+            short URL, long URL
+    index:  short URL hash, record offset
+
+"""
+import hashlib
+import logging
+import mmap
+import os
+import struct
+import threading
+import time
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b"TLSNAP02"
+HEADER = struct.Struct("<8sQQQ")
+RECORD = struct.Struct("<QiHI")
+INDEX_ENTRY = struct.Struct("<IQ")
+
+
+def hash_short_url(short_url):
+    digest = hashlib.blake2b(short_url, digest_size=4).digest()
+    return int.from_bytes(digest, "little")
+
+
+def write_snapshot(path, rows, generation=None):
+    """
+    Writes a snapshot of ``rows`` to ``path`` and returns the record count.
+
+    ``rows`` is an iterable of ``(pk, short_url, long_url, cache_max_age)``
+    tuples. The file
+    is written next to ``path`` and moved into place at the end, so readers
+    never see a partial snapshot.
+
+    """
+    if generation is None:
+        generation = time.time_ns()
+    tmp_path = "{}.{}.tmp".format(path, os.getpid())
+    keys = []
+    offsets = []
+    try:
+        with open(tmp_path, "wb") as f:
+            f.write(HEADER.pack(MAGIC, generation, 0, 0))
+            offset = HEADER.size
+            for pk, short_url, long_url, max_age in rows:
+                short_url = short_url.encode("utf-8")
+                long_url = long_url.encode("utf-8")
+                keys.append(hash_short_url(short_url) << 32 | len(offsets))
+                offsets.append(offset)
+                record = RECORD.pack(
+                    pk,
+                    -1 if max_age is None else max_age,
+                    len(short_url),
+                    len(long_url),
+                )
+                f.write(record)
+                f.write(short_url)
+                f.write(long_url)
+                offset += len(record) + len(short_url) + len(long_url)
+            keys.sort()
+            for key in keys:
+                f.write(INDEX_ENTRY.pack(key >> 32, offsets[key & 0xFFFFFFFF]))
+            f.seek(0)
+            f.write(HEADER.pack(MAGIC, generation, len(offsets), offset))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return len(offsets)
+
+
+class RedirectSnapshot(object):
+    """Read-only view of a snapshot file."""
+
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.generation, self.count, self._index = HEADER.unpack_from(self._map)
+        if magic != MAGIC:
+            raise ValueError("{} is not a tinylinks snapshot.".format(path))
+
+    def _entry(self, i):
+        return INDEX_ENTRY.unpack_from(self._map, self._index + i * INDEX_ENTRY.size)
+
+    def lookup(self, short_url):
+        """
+        Returns ``(pk, long_url, cache_max_age)`` for ``short_url`` or
+        ``None``.
+
+        """
+        short_url = short_url.encode("utf-8")
+        key = hash_short_url(short_url)
+        # Find the first index entry with a matching hash.
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            if self._entry(middle)[0] < key:
+                low = middle + 1
+            else:
+                high = middle
+        for i in range(low, self.count):
+            entry_key, offset = self._entry(i)
+            if entry_key != key:
+                break
+            pk, max_age, short_length, long_length = RECORD.unpack_from(
+                self._map, offset
+            )
+            start = offset + RECORD.size
+            if self._map[start : start + short_length] == short_url:
+                start += short_length
+                long_url = self._map[start : start + long_length].decode("utf-8")
+                return pk, long_url, None if max_age < 0 else max_age
+        return None
+
+
+class SnapshotLoader(object):
+    """
+    Provides the current snapshot of a worker process.
+
+    The generation in the header of the file is checked at most every
+    ``check_interval`` seconds. New generations are mapped and swapped in
+    atomically.
+
+    Changed and deleted tinylinks override the snapshot with entries in the
+    shared cache which expire after ``max_age`` seconds. Snapshots built
+    earlier than that are ignored, and the snapshot isn't used at all unless
+    the shared cache is seen by all worker processes.
+
+    """
+
+    def __init__(self, path, check_interval=10, max_age=86400):
+        self.path = path
+        self.check_interval = check_interval
+        self.max_age = max_age
+        self.snapshot = None
+        self._checked = None
+        self._refused = False
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        """Returns whether a snapshot is configured and may be used."""
+        from tinylinks.cache import get_cross_process_cache
+
+        if not self.path:
+            return False
+        if get_cross_process_cache() is None:
+            if not self._refused:
+                self._refused = True
+                logger.error(
+                    "The snapshot %s is not used, because TINYLINK_CACHE_ALIAS "
+                    "isn't a cache shared by all worker processes.",
+                    self.path,
+                )
+            return False
+        return True
+
+    def get(self):
+        """Returns the current ``RedirectSnapshot`` or ``None``."""
+        if not self.enabled:
+            return None
+        now = time.monotonic()
+        if self._checked is None or now - self._checked >= self.check_interval:
+            with self._lock:
+                self._checked = now
+                try:
+                    self.reload()
+                except (OSError, ValueError, struct.error):
+                    logger.exception("Loading the snapshot %s failed.", self.path)
+                if self.snapshot is not None and self.is_outdated(self.snapshot):
+                    logger.warning(
+                        "The snapshot %s is older than %s seconds and not used.",
+                        self.path,
+                        self.max_age,
+                    )
+        snapshot = self.snapshot
+        if snapshot is None or self.is_outdated(snapshot):
+            return None
+        return snapshot
+
+    def is_outdated(self, snapshot):
+        return time.time_ns() - snapshot.generation > self.max_age * 10**9
+
+    def reload(self):
+        try:
+            with open(self.path, "rb") as f:
+                header = f.read(HEADER.size)
+        except FileNotFoundError:
+            self.snapshot = None
+            return
+        generation = HEADER.unpack(header)[1]
+        current = self.snapshot
+        if current is not None and current.generation == generation:
+            return
+        # Readers may still use the old map, it is unmapped once it is gone.
+        self.snapshot = RedirectSnapshot(self.path)
+
+    def lookup(self, short_url):
+        snapshot = self.get()
+        if snapshot is None:
+            return None
+        return snapshot.lookup(short_url)
+
+
+snapshot_loader = SnapshotLoader(
+    path=getattr(settings, "TINYLINK_SNAPSHOT_PATH", None),
+    check_interval=getattr(settings, "TINYLINK_SNAPSHOT_CHECK_INTERVAL", 10),
+    max_age=getattr(settings, "TINYLINK_SNAPSHOT_MAX_AGE", 86400),
+)
@@ -8,6 +8,8 @@ SITE_ID = 1
 TINYLINK_LENGTH = 5
 TINYLINK_CHECK_INTERVAL = 10
 TINYLINK_CHECK_PERIOD = 300
+TINYLINK_VIEW_COUNTER_INTERVAL = 0
+TINYLINK_LOG_INTERVAL = 0
 
 PASSWORD_HASHERS = ("django.contrib.auth.hashers.MD5PasswordHasher",)
 
@@ -1,24 +1,92 @@
 import datetime
+import os
 import socket
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 from unittest.mock import Mock, patch
-from urllib.request import OpenerDirector
 
 import pytz
+from asgiref.sync import async_to_sync
 from django.contrib.auth import get_user_model
+from django.contrib.auth.models import AnonymousUser
 from django.contrib.auth.hashers import make_password
-from django.test import TestCase
-from rest_framework import status
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.test import (
+    RequestFactory,
+    TestCase,
+    TransactionTestCase,
+    override_settings,
+    skipUnlessDBFeature,
+)
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework import permissions, status
 from rest_framework.reverse import reverse
 from rest_framework.test import APITestCase
+from urllib3._collections import HTTPHeaderDict
 from urllib3.exceptions import HTTPError, MaxRetryError, TimeoutError
 
+from ..allocator import ALPHABET, ShortUrlAllocator, decode, permute, unpermute
+from ..bloom import BloomFilter, ShortUrlFilter, announce_short_urls
+from ..canonical import canonicalize_url
+from ..checker import HostBreaker, LinkChecker
+from ..client import LinkClient, link_client, open_url
+from ..buffers import LogWriter, ViewCounter
+from ..cache import RedirectCache, lookup_tinylink, redirect_cache
 from ..forms import TinylinkAdminForm, TinylinkForm
-from ..models import Tinylink, TinylinkLog, get_url_response, validate_long_url
+from ..jobs import enqueue_validation, process_validation_jobs
+from ..management.commands.check_tinylink_targets import Command as CheckCommand
+from ..metrics import Histogram, LatencyRecorder
+from ..models import (
+    ShortUrlSequence,
+    Tinylink,
+    TinylinkLog,
+    ValidationJob,
+    get_url_response,
+    hash_long_url,
+    validate_long_url,
+)
+from ..serializers import TinylinkSerializer
+from ..upsert import upsert_tinylink, upsert_tinylinks
+from ..scheduler import (
+    claim_due_tinylinks,
+    due_tinylinks,
+    get_check_interval,
+    release_tinylinks,
+    schedule_checks,
+)
+from ..snapshot import RedirectSnapshot, SnapshotLoader, write_snapshot
 from ..utils import shortify_url
+from . import test_settings
+from ..views import (
+    tinylink_expand,
+    tinylink_expand_async,
+    tinylink_redirect_async,
+)
 
 User = get_user_model()
 
 
+def use_file_cache(test):
+    """Makes ``test`` use a cache which several processes can share."""
+    tmp_dir = tempfile.TemporaryDirectory()
+    test.addCleanup(tmp_dir.cleanup)
+    caches_override = override_settings(
+        CACHES={
+            "default": {
+                "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
+                "LOCATION": tmp_dir.name,
+            }
+        }
+    )
+    caches_override.enable()
+    test.addCleanup(caches_override.disable)
+
+
 class TinyLinkTest(APITestCase):
     def setUp(self):
         self.tiny_link_list_url = reverse("tinylink_list")
@@ -214,6 +282,14 @@ class TinyLinkRestViewTest(TestCase):
         )
         self.assertEqual(tiny_link_list_response.status_code, status.HTTP_404_NOT_FOUND)
 
+    def test_links_list_with_long_url(self):
+        self.client.force_login(user=self.user)
+        response = self.client.get(
+            "/s/api/tinylinks/", {"url": "http://www.example.com"}
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()["results"][0]["short_url"], "vB7f5b")
+
     def test_unauthenticated_admin_links_list(self):
         """
         test get links list if user.is_admin = False
@@ -300,7 +376,8 @@ class TinyLinkRestViewTest(TestCase):
     def test_redirect_with_no_url(self):
         self.client.force_login(user=self.user)
         self.tiny_link.long_url = ""
-        self.tiny_link.save()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.tiny_link.save()
         self.tiny_link_url_stats = reverse(
             "tinylink_redirect", kwargs={"short_url": self.tiny_link.short_url}
         )
@@ -411,49 +488,24 @@ class TinyLinkModelTest(TestCase):
         response = Mock()
         mock_fn.return_value = response
         response.status = 200
+        response.headers = {}
         validate_long_url(self.link)
         self.assertFalse(self.link.is_broken)
 
-    @patch("tinylinks.models.get_url_response")
-    def test_validate_long_url_with_status_response_pdf(self, mock_fn):
-        response = Mock()
-        mock_fn.return_value = response
-        response.status = 302
-        self.link.long_url = "blah.pdf"
-        validate_long_url(self.link)
-        self.assertFalse(self.link.is_broken)
-
-    @patch("tinylinks.models.get_url_response")
-    def test_validate_long_url_with_status_response_redirect(self, mock_fn):
-        def get_redirect_location():
-            return "blah"
-
-        response = Mock()
-        redirect = Mock()
-        redirect.status = 200
-        response.status = 302
-        response.get_redirect_location = get_redirect_location
-        mock_fn.side_effect = [response, redirect]
-        validate_long_url(self.link)
-        self.assertFalse(self.link.is_broken)
-
-    @patch("tinylinks.models.get_url_response")
-    def test_validate_long_url_with_status_redirect_two(self, mock_fn):
-        def get_redirect_location():
-            return "http://localhost"
-
-        response = Mock()
-        redirect = Mock()
-        response.status = 302
-        redirect.status = 302
-        response.get_redirect_location = get_redirect_location
-        mock_fn.side_effect = [response, redirect]
-        with patch.object(OpenerDirector, "open") as mk:
-            res = Mock()
-            res.code = 200
-            mk.return_value = res
-            validate_long_url(self.link)
-        self.assertFalse(self.link.is_broken)
+    def test_get_url_response_follows_redirects(self):
+        redirect = Mock(status=302, headers=HTTPHeaderDict())
+        redirect.get_redirect_location.return_value = "/next"
+        page = Mock(status=200, headers=HTTPHeaderDict())
+        page.get_redirect_location.return_value = False
+        self.pool.urlopen.side_effect = [redirect, page]
+        response = get_url_response(self.pool, self.link, self.link.long_url)
+        self.assertIs(response, page)
+        self.assertEqual(self.link.redirect_location, "http://www.example.com/next")
+        self.assertEqual(self.link.redirect_count, 1)
+        self.assertEqual(
+            self.pool.urlopen.call_args.args, ("HEAD", "http://www.example.com/next")
+        )
+        self.assertFalse(self.pool.urlopen.call_args.kwargs["redirect"])
 
     @patch("tinylinks.models.get_url_response")
     def test_validate_long_url_server_code_with_broken_link(self, mock_fn):
@@ -471,6 +523,16 @@ class TinyLinkModelTest(TestCase):
         validate_long_url(self.link)
         self.assertEqual(self.link.validation_error, "URL not accessible.")
 
+    def test_long_url_hash(self):
+        self.assertEqual(self.link.long_url_hash, hash_long_url(self.link.long_url))
+        self.link.long_url = "http://www.example.com/changed"
+        self.link.save()
+        self.assertTrue(
+            Tinylink.objects.filter(
+                long_url_hash=hash_long_url("http://www.example.com/changed")
+            ).exists()
+        )
+
     def test_can_not_be_validated(self):
         self.assertEqual(False, self.link.can_be_validated())
 
@@ -560,3 +622,1493 @@ class TinyLinkFormTests(TestCase):
         print(form.errors)
         shortify_url(self.link.long_url)
         self.assertFalse(form.is_valid())
+
+
+class RedirectCacheTest(TestCase):
+    def setUp(self):
+        redirect_cache.clear()
+        cache.clear()
+        self.link = Tinylink.objects.create(
+            long_url="http://www.example.com/thisisalongURL",
+            short_url="vB7f5b",
+        )
+        self.redirect_url = reverse(
+            "tinylink_redirect", kwargs={"short_url": self.link.short_url}
+        )
+
+    def test_lru_eviction(self):
+        cache = RedirectCache(maxsize=2, timeout=None)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        cache.get("a")
+        cache.set("c", 3)
+        self.assertEqual(cache.get("a"), 1)
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.info()["hits"], 2)
+        self.assertEqual(cache.info()["misses"], 1)
+        self.assertEqual(cache.info()["size"], 2)
+
+    def test_timeout(self):
+        cache = RedirectCache(maxsize=2, timeout=-1)
+        cache.set("a", 1)
+        self.assertIsNone(cache.get("a"))
+
+    def test_redirect_uses_cache(self):
+        self.client.get(self.redirect_url)
+        # Only the view counter update and the log insert remain.
+        with self.assertNumQueries(2):
+            response = self.client.get(self.redirect_url)
+        self.assertEqual(response["Location"], self.link.long_url)
+        self.link.refresh_from_db()
+        self.assertEqual(self.link.amount_of_views, 2)
+
+    def test_invalidate_on_save(self):
+        lookup_tinylink("vB7f5b")
+        link = Tinylink.objects.get(pk=self.link.pk)
+        link.short_url = "changed"
+        link.long_url = "http://www.example.com/changed"
+        with self.captureOnCommitCallbacks(execute=True):
+            link.save()
+        self.assertIsNone(lookup_tinylink("vB7f5b"))
+        self.assertEqual(
+            lookup_tinylink("changed").long_url, "http://www.example.com/changed"
+        )
+
+    def test_invalidate_on_delete(self):
+        lookup_tinylink("vB7f5b")
+        with self.captureOnCommitCallbacks(execute=True):
+            self.link.delete()
+        self.assertIsNone(lookup_tinylink("vB7f5b"))
+
+    def test_cache_is_dropped_after_commit(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.link.long_url = "http://www.example.com/changed"
+            self.link.save()
+            # A concurrent redirect still reads the committed row.
+            cache.set(
+                "tinylinks:redirect:vB7f5b",
+                (self.link.pk, "http://www.example.com/thisisalongURL", None),
+            )
+        for callback in callbacks:
+            callback()
+        self.assertEqual(
+            lookup_tinylink("vB7f5b").long_url, "http://www.example.com/changed"
+        )
+
+    def test_shared_cache(self):
+        lookup_tinylink("vB7f5b")
+        redirect_cache.clear()
+        with self.assertNumQueries(0):
+            target = lookup_tinylink("vB7f5b")
+        self.assertEqual(target.pk, self.link.pk)
+
+    def test_not_found_is_cached(self):
+        self.assertIsNone(lookup_tinylink("unknown"))
+        with self.assertNumQueries(0):
+            response = self.client.get(
+                reverse("tinylink_redirect", kwargs={"short_url": "unknown"})
+            )
+        self.assertEqual(response["Location"], reverse("tinylink_notfound"))
+        with self.captureOnCommitCallbacks(execute=True):
+            Tinylink.objects.create(
+                long_url="http://www.example.com/new", short_url="unknown"
+            )
+        self.assertEqual(
+            lookup_tinylink("unknown").long_url, "http://www.example.com/new"
+        )
+
+
+class ViewCounterTest(TestCase):
+    def setUp(self):
+        self.link = Tinylink.objects.create(
+            long_url="http://www.example.com/thisisalongURL",
+            short_url="vB7f5b",
+        )
+        self.other_link = Tinylink.objects.create(
+            long_url="http://www.example.com/other",
+            short_url="xT3y2a",
+        )
+
+    def test_increments_are_coalesced(self):
+        counter = ViewCounter(interval=3600)
+        counter._thread = Mock()
+        for _ in range(3):
+            counter.increment(self.link.pk)
+            counter.increment(self.other_link.pk)
+        self.assertEqual(counter.pending(), 6)
+        with self.assertNumQueries(1):
+            counter.flush()
+        self.link.refresh_from_db()
+        self.other_link.refresh_from_db()
+        self.assertEqual(self.link.amount_of_views, 3)
+        self.assertEqual(self.other_link.amount_of_views, 3)
+        self.assertEqual(counter.pending(), 0)
+
+    def test_failed_flush_keeps_increments(self):
+        counter = ViewCounter(interval=3600)
+        counter._thread = Mock()
+        counter.increment(self.link.pk)
+        with patch.object(counter, "_write", side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                counter.flush()
+        self.assertEqual(counter.pending(), 1)
+        counter._pending.clear()
+
+    def test_synchronous_without_interval(self):
+        counter = ViewCounter(interval=0)
+        counter.increment(self.link.pk)
+        self.link.refresh_from_db()
+        self.assertEqual(self.link.amount_of_views, 1)
+
+
+class LogWriterTest(TestCase):
+    def setUp(self):
+        self.link = Tinylink.objects.create(
+            long_url="http://www.example.com/thisisalongURL",
+            short_url="vB7f5b",
+        )
+
+    def get_log(self):
+        return TinylinkLog(tinylink=self.link, user_agent="Test", remote_ip="127.0.0.1")
+
+    def test_logs_are_inserted_in_batches(self):
+        writer = LogWriter(interval=3600, batch_size=2)
+        writer._thread = Mock()
+        clicked = self.get_log()
+        writer.add(clicked)
+        self.assertFalse(writer._wakeup.is_set())
+        writer.add(self.get_log())
+        self.assertTrue(writer._wakeup.is_set())
+        writer.add(self.get_log())
+        with self.assertNumQueries(2):
+            writer.flush()
+        self.assertEqual(TinylinkLog.objects.count(), 3)
+        self.assertEqual(
+            TinylinkLog.objects.order_by("pk").first().datetime, clicked.datetime
+        )
+
+    def test_drops_logs_when_full(self):
+        writer = LogWriter(interval=3600, batch_size=10, max_size=2)
+        writer._thread = Mock()
+        for _ in range(3):
+            writer.add(self.get_log())
+        self.assertEqual(writer.pending(), 2)
+        self.assertEqual(writer.dropped, 1)
+        writer.flush()
+        self.assertEqual(TinylinkLog.objects.count(), 2)
+
+
+class LogWriterDeletedLinkTest(TransactionTestCase):
+    def setUp(self):
+        self.link = Tinylink.objects.create(
+            long_url="http://www.example.com/thisisalongURL",
+            short_url="vB7f5b",
+        )
+        self.writer = LogWriter(interval=3600, batch_size=10)
+        self.writer._thread = Mock()
+
+    def get_log(self, tinylink, remote_ip="127.0.0.1"):
+        return TinylinkLog(tinylink=tinylink, user_agent="Test", remote_ip=remote_ip)
+
+    def test_logs_of_deleted_links_dont_block_the_buffer(self):
+        deleted = Tinylink.objects.create(
+            long_url="http://www.example.com/deleted", short_url="dE1e7d"
+        )
+        self.writer.add(self.get_log(deleted))
+        self.writer.add(self.get_log(self.link))
+        Tinylink.objects.filter(pk=deleted.pk).delete()
+        self.writer.flush()
+        self.assertEqual(self.writer.pending(), 0)
+        self.assertEqual(self.writer.dropped, 0)
+        self.assertEqual(TinylinkLog.objects.filter(tinylink=None).count(), 1)
+        self.writer.add(self.get_log(self.link))
+        self.writer.flush()
+        self.assertEqual(TinylinkLog.objects.filter(tinylink=self.link).count(), 2)
+
+    def test_invalid_logs_are_dropped(self):
+        self.writer.add(self.get_log(self.link, remote_ip=None))
+        self.writer.add(self.get_log(self.link))
+        with self.assertLogs("tinylinks.buffers"):
+            self.writer.flush()
+        self.assertEqual(self.writer.pending(), 0)
+        self.assertEqual(self.writer.dropped, 1)
+        self.assertEqual(TinylinkLog.objects.count(), 1)
+
+
+class AsyncViewsTest(TestCase):
+    def setUp(self):
+        redirect_cache.clear()
+        cache.clear()
+        self.factory = RequestFactory()
+        self.link = Tinylink.objects.create(
+            long_url="http://www.example.com/thisisalongURL",
+            short_url="vB7f5b",
+        )
+
+    def test_redirect(self):
+        request = self.factory.get("/s/vB7f5b", HTTP_REFERER="http://example.org")
+        response = async_to_sync(tinylink_redirect_async)(request, "vB7f5b")
+        self.assertEqual(response.status_code, status.HTTP_302_FOUND)
+        self.assertEqual(response["Location"], self.link.long_url)
+        self.link.refresh_from_db()
+        self.assertEqual(self.link.amount_of_views, 1)
+        self.assertEqual(
+            TinylinkLog.objects.get(tinylink=self.link).referrer, "http://example.org"
+        )
+
+    def test_redirect_not_found(self):
+        request = self.factory.get("/s/blah")
+        response = async_to_sync(tinylink_redirect_async)(request, "blah")
+        self.assertEqual(response["Location"], reverse("tinylink_notfound"))
+
+    def test_redirect_with_no_url(self):
+        Tinylink.objects.filter(pk=self.link.pk).update(long_url="")
+        request = self.factory.get("/s/vB7f5b")
+        response = async_to_sync(tinylink_redirect_async)(request, "vB7f5b")
+        self.assertEqual(response.status_code, status.HTTP_410_GONE)
+
+    def test_expand(self):
+        request = self.factory.get("/s/api/expand/vB7f5b/")
+        response = async_to_sync(tinylink_expand_async)(request, "vB7f5b")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertJSONEqual(
+            response.content,
+            {"short_url": "vB7f5b", "long_url": self.link.long_url},
+        )
+        response = async_to_sync(tinylink_expand_async)(request, "blah")
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_expand_rejects_other_methods(self):
+        request = self.factory.post("/s/api/expand/vB7f5b/")
+        response = async_to_sync(tinylink_expand_async)(request, "vB7f5b")
+        self.assertEqual(response.status_code, status.HTTP_405_METHOD_NOT_ALLOWED)
+
+    def test_expand_applies_api_permissions(self):
+        request = self.factory.get("/s/api/expand/vB7f5b/")
+        with patch.object(
+            tinylink_expand.cls, "permission_classes", (permissions.IsAuthenticated,)
+        ):
+            request.user = AnonymousUser()
+            response = async_to_sync(tinylink_expand_async)(request, "vB7f5b")
+            self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+            request.user = get_user_model().objects.create(username="expander")
+            response = async_to_sync(tinylink_expand_async)(request, "vB7f5b")
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+
+@override_settings(
+    MIDDLEWARE=("tinylinks.middleware.TinylinkRedirectMiddleware",)
+    + test_settings.MIDDLEWARE
+)
+class TinylinkRedirectMiddlewareTest(TestCase):
+    def setUp(self):
+        redirect_cache.clear()
+        cache.clear()
+        self.link = Tinylink.objects.create(
+            long_url="http://www.example.com/thisisalongURL",
+            short_url="vB7f5b",
+        )
+
+    def test_redirect(self):
+        lookup_tinylink("vB7f5b")
+        with self.assertNumQueries(2):
+            response = self.client.get("/s/vB7f5b", {"utm_source": "test"})
+        self.assertEqual(response.status_code, status.HTTP_302_FOUND)
+        self.assertEqual(response["Location"], self.link.long_url)
+        self.assertNotIn("sessionid", response.cookies)
+        self.link.refresh_from_db()
+        self.assertEqual(self.link.amount_of_views, 1)
+
+    def test_redirect_not_found(self):
+        response = self.client.get("/s/blah")
+        self.assertEqual(response["Location"], reverse("tinylink_notfound"))
+
+    def test_other_urls_are_passed_on(self):
+        Tinylink.objects.create(
+            long_url="http://www.example.com/statistics", short_url="statistics"
+        )
+        response = self.client.get("/s/statistics")
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        response = self.client.get("/s/404/")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+
+class ShortUrlFilterTest(TestCase):
+    def setUp(self):
+        redirect_cache.clear()
+        cache.clear()
+        self.link = Tinylink.objects.create(
+            long_url="http://www.example.com/thisisalongURL",
+            short_url="vB7f5b",
+        )
+        self.filter = ShortUrlFilter(
+            enabled=True, capacity=100, error_rate=0.001, sync_interval=3600
+        )
+        self.filter._thread = Mock()
+
+    def test_bloom_filter(self):
+        bloom = BloomFilter(capacity=1000, error_rate=0.01)
+        for i in range(1000):
+            bloom.add("code{}".format(i))
+        self.assertTrue(all("code{}".format(i) in bloom for i in range(1000)))
+        false_positives = sum("other{}".format(i) in bloom for i in range(1000))
+        self.assertLess(false_positives, 50)
+        self.assertEqual(bloom.info()["count"], 1000)
+        self.assertLess(bloom.info()["size"], 1300)
+
+    def test_unknown_short_url(self):
+        use_file_cache(self)
+        self.assertTrue(self.filter.might_exist("vB7f5b"))
+        self.assertTrue(self.filter.might_exist("blah"))
+        self.filter.rebuild()
+        with patch("tinylinks.cache.short_url_filter", self.filter):
+            with self.assertNumQueries(0):
+                self.assertIsNone(lookup_tinylink("blah"))
+            self.assertIsNotNone(lookup_tinylink("vB7f5b"))
+
+    def test_unknown_short_url_without_shared_cache(self):
+        self.filter.rebuild()
+        self.assertTrue(self.filter.might_exist("blah"))
+        with patch("tinylinks.cache.short_url_filter", self.filter):
+            with self.assertNumQueries(1):
+                self.assertIsNone(lookup_tinylink("blah"))
+
+    def test_sync(self):
+        use_file_cache(self)
+        self.filter.rebuild()
+        Tinylink.objects.bulk_create(
+            [Tinylink(long_url="http://www.example.com/new", short_url="new")]
+        )
+        self.assertFalse(self.filter.might_exist("new"))
+        with patch("tinylinks.bloom.short_url_filter", Mock(enabled=True)):
+            with self.captureOnCommitCallbacks(execute=True):
+                announce_short_urls(["other"])
+        # Short URLs are looked up until the next synchronisation.
+        self.assertTrue(self.filter.might_exist("new"))
+        self.filter.sync()
+        self.assertTrue(self.filter.might_exist("new"))
+        self.assertFalse(self.filter.might_exist("unknown"))
+
+    def test_bloom_stats(self):
+        user = User.objects.create_user(username="user", password="test1234")
+        self.client.force_login(user)
+        response = self.client.get(reverse("api_bloom_stats"))
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+        user.is_staff = True
+        user.save()
+        self.filter.rebuild()
+        with patch("tinylinks.views.short_url_filter", self.filter):
+            response = self.client.get(reverse("api_bloom_stats"))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.json()["enabled"])
+        self.assertEqual(response.json()["filter"]["count"], 1)
+
+
+class RedirectSnapshotTest(TestCase):
+    def setUp(self):
+        redirect_cache.clear()
+        cache.clear()
+        self.link = Tinylink.objects.create(
+            long_url="http://www.example.com/thisisalongURL",
+            short_url="vB7f5b",
+        )
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        self.path = os.path.join(tmp_dir.name, "snapshot.bin")
+        use_file_cache(self)
+
+    def test_write_and_lookup(self):
+        rows = [
+            (i, "code{}".format(i), "http://example.com/{}".format(i), i or None)
+            for i in range(500)
+        ]
+        self.assertEqual(write_snapshot(self.path, rows), 500)
+        snapshot = RedirectSnapshot(self.path)
+        self.assertEqual(snapshot.count, 500)
+        for pk, short_url, long_url, max_age in rows:
+            self.assertEqual(snapshot.lookup(short_url), (pk, long_url, max_age))
+        self.assertIsNone(snapshot.lookup("unknown"))
+
+    def test_loader_swaps_generations(self):
+        loader = SnapshotLoader(self.path, check_interval=0)
+        self.assertIsNone(loader.lookup("vB7f5b"))
+        generation = time.time_ns()
+        rows = [(1, "vB7f5b", "http://example.com/1", None)]
+        write_snapshot(self.path, rows, generation)
+        self.assertEqual(loader.lookup("vB7f5b"), (1, "http://example.com/1", None))
+        rows = [(1, "vB7f5b", "http://example.com/2", 60)]
+        write_snapshot(self.path, rows, generation + 1)
+        self.assertEqual(loader.lookup("vB7f5b"), (1, "http://example.com/2", 60))
+        self.assertEqual(loader.get().generation, generation + 1)
+
+    def test_loader_ignores_outdated_snapshots(self):
+        loader = SnapshotLoader(self.path, check_interval=0, max_age=60)
+        generation = time.time_ns() - 61 * 10**9
+        rows = [(1, "vB7f5b", "http://example.com/1", None)]
+        write_snapshot(self.path, rows, generation)
+        with self.assertLogs("tinylinks.snapshot", "WARNING"):
+            self.assertIsNone(loader.lookup("vB7f5b"))
+
+    @override_settings(TINYLINK_CACHE_ALIAS=None)
+    def test_loader_needs_shared_cache(self):
+        write_snapshot(self.path, [(1, "vB7f5b", "http://example.com/1", None)])
+        loader = SnapshotLoader(self.path, check_interval=0)
+        with self.assertLogs("tinylinks.snapshot", "ERROR"):
+            self.assertIsNone(loader.lookup("vB7f5b"))
+        self.assertFalse(loader.enabled)
+
+    def test_lookup_uses_snapshot(self):
+        call_command("build_tinylink_snapshot", path=self.path, stdout=Mock())
+        loader = SnapshotLoader(self.path, check_interval=3600)
+        with patch("tinylinks.cache.snapshot_loader", loader):
+            with self.assertNumQueries(0):
+                target = lookup_tinylink("vB7f5b")
+            self.assertEqual(target.long_url, self.link.long_url)
+            self.link.long_url = "http://www.example.com/changed"
+            with self.captureOnCommitCallbacks(execute=True):
+                self.link.save()
+            self.assertEqual(
+                lookup_tinylink("vB7f5b").long_url, "http://www.example.com/changed"
+            )
+            with self.captureOnCommitCallbacks(execute=True):
+                self.link.delete()
+            self.assertIsNone(lookup_tinylink("vB7f5b"))
+
+
+purged_paths = []
+
+
+def purge_paths(paths):
+    purged_paths.extend(paths)
+
+
+class EdgeCacheTest(TestCase):
+    def setUp(self):
+        redirect_cache.clear()
+        cache.clear()
+        del purged_paths[:]
+        self.link = Tinylink.objects.create(
+            long_url="http://www.example.com/thisisalongURL",
+            short_url="vB7f5b",
+        )
+
+    def test_no_cache_headers_by_default(self):
+        response = self.client.get("/s/vB7f5b")
+        self.assertNotIn("Cache-Control", response)
+        self.assertNotIn("ETag", response)
+
+    @override_settings(TINYLINK_REDIRECT_SHARED_MAX_AGE=3600)
+    def test_cache_headers(self):
+        response = self.client.get("/s/vB7f5b")
+        self.assertEqual(response.status_code, status.HTTP_302_FOUND)
+        self.assertIn("s-maxage=3600", response["Cache-Control"])
+        self.assertIn("public", response["Cache-Control"])
+        response = self.client.get("/s/vB7f5b", HTTP_IF_NONE_MATCH=response["ETag"])
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    @override_settings(
+        TINYLINK_REDIRECT_MAX_AGE=60, TINYLINK_REDIRECT_SHARED_MAX_AGE=3600
+    )
+    def test_cache_max_age_of_tinylink(self):
+        self.link.cache_max_age = 30
+        self.link.save()
+        response = self.client.get("/s/vB7f5b")
+        self.assertIn("max-age=30", response["Cache-Control"])
+        self.assertIn("s-maxage=30", response["Cache-Control"])
+
+    @override_settings(TINYLINK_PURGE_CALLBACK="tinylinks.tests.tests.purge_paths")
+    def test_purge_callback(self):
+        link = Tinylink.objects.get(pk=self.link.pk)
+        with self.captureOnCommitCallbacks(execute=True):
+            link.amount_of_views = 5
+            link.save()
+        self.assertEqual(purged_paths, [])
+        with self.captureOnCommitCallbacks(execute=True):
+            link.long_url = "http://www.example.com/changed"
+            link.save()
+        self.assertEqual(purged_paths, ["/s/vB7f5b"])
+        with self.captureOnCommitCallbacks(execute=True):
+            link.delete()
+        self.assertEqual(purged_paths, ["/s/vB7f5b", "/s/vB7f5b"])
+
+    @override_settings(TINYLINK_PURGE_CALLBACK="tinylinks.tests.tests.purge_paths")
+    def test_cache_max_age_from_forms_and_api(self):
+        link = Tinylink.objects.create(
+            long_url="http://www.example.com/cached", short_url="cached1"
+        )
+        form = TinylinkAdminForm(
+            instance=link,
+            data={
+                "long_url": link.long_url,
+                "short_url": link.short_url,
+                "cache_max_age": 120,
+            },
+        )
+        self.assertTrue(form.is_valid(), form.errors)
+        with self.captureOnCommitCallbacks(execute=True):
+            form.save()
+        self.assertEqual(purged_paths, ["/s/cached1"])
+        serializer = TinylinkSerializer(
+            data={"long_url": link.long_url, "cache_max_age": 60}
+        )
+        self.assertTrue(serializer.is_valid(), serializer.errors)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(serializer.save().pk, link.pk)
+        self.assertEqual(serializer.data["cache_max_age"], 60)
+        self.assertEqual(purged_paths, ["/s/cached1", "/s/cached1"])
+        self.assertEqual(lookup_tinylink("cached1").max_age, 60)
+
+    def test_ingest_clicks(self):
+        admin = User.objects.create_superuser(
+            username="admin", email="admin@example.com", password="test1234"
+        )
+        self.client.force_login(admin)
+        response = self.client.post(
+            reverse("api_clicks"),
+            [
+                {"short_url": "vB7f5b", "remote_ip": "127.0.0.1"},
+                {"short_url": "vB7f5b", "remote_ip": "127.0.0.2", "referrer": "x"},
+                {"short_url": "blah", "remote_ip": "127.0.0.1"},
+            ],
+            content_type="application/json",
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json(), {"recorded": 2, "unknown": 1})
+        self.link.refresh_from_db()
+        self.assertEqual(self.link.amount_of_views, 2)
+        self.assertEqual(TinylinkLog.objects.filter(tinylink=self.link).count(), 2)
+
+
+class LatencyMetricsTest(TestCase):
+    def setUp(self):
+        redirect_cache.clear()
+        cache.clear()
+        self.link = Tinylink.objects.create(
+            long_url="http://www.example.com/thisisalongURL",
+            short_url="vB7f5b",
+        )
+        self.recorder = LatencyRecorder(enabled=True, publish_interval=0)
+        patcher = patch("tinylinks.views.latency_recorder", self.recorder)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_histogram(self):
+        histogram = Histogram()
+        self.assertIsNone(histogram.percentile(0.5))
+        for i in range(99):
+            histogram.add(0.001)
+        histogram.add(1)
+        self.assertEqual(histogram.summary()["count"], 100)
+        self.assertTrue(0.001 <= histogram.percentile(0.5) < 0.0015)
+        self.assertTrue(0.001 <= histogram.percentile(0.99) < 0.0015)
+        self.assertTrue(1 <= histogram.percentile(1) < 1.5)
+        histogram.add(100)
+        self.assertTrue(histogram.percentile(1) < 100)
+
+    def test_disabled_recorder(self):
+        recorder = LatencyRecorder(enabled=False)
+        with recorder.time("lookup"):
+            pass
+        self.assertEqual(recorder.get_counts(), {})
+
+    def test_publishes_in_background(self):
+        recorder = LatencyRecorder(enabled=True, publish_interval=3600)
+        recorder._thread = Mock()
+        with patch("tinylinks.metrics.get_shared_cache") as get_shared_cache:
+            with recorder.time("lookup"):
+                pass
+            get_shared_cache.assert_not_called()
+            recorder.flush()
+            get_shared_cache.assert_called_once_with()
+
+    def test_redirect_stages(self):
+        self.client.get("/s/vB7f5b")
+        stages = self.recorder.collect()["stages"]
+        self.assertEqual(set(stages), {"lookup", "counter", "cookies", "log"})
+        self.assertEqual(stages["lookup"]["count"], 1)
+
+    def test_published_workers(self):
+        self.client.get("/s/vB7f5b")
+        cache.set("tinylinks:metrics:workers", [self.recorder.worker, "other:1"])
+        cache.set("tinylinks:metrics:worker:other:1", self.recorder.get_counts())
+        data = self.recorder.collect()
+        self.assertEqual(set(data["workers"]), {self.recorder.worker, "other:1"})
+        self.assertEqual(data["stages"]["lookup"]["count"], 2)
+
+    def test_latency_stats(self):
+        user = User.objects.create_user(username="user", password="test1234")
+        self.client.force_login(user)
+        response = self.client.get(reverse("api_latency_stats"))
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+        user.is_staff = True
+        user.save()
+        self.client.get("/s/vB7f5b")
+        response = self.client.get(reverse("api_latency_stats"))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()["stages"]["log"]["count"], 1)
+
+
+class ShortUrlAllocatorTest(TestCase):
+    def test_permutation(self):
+        for length in (1, 2, 3):
+            space = len(ALPHABET) ** length
+            values = [permute(value, length, "secret") for value in range(space)]
+            self.assertEqual(sorted(values), list(range(space)))
+            for value in range(0, space, 7):
+                self.assertEqual(
+                    unpermute(permute(value, length, "secret"), length, "secret"),
+                    value,
+                )
+
+    def test_allocate(self):
+        allocator = ShortUrlAllocator()
+        short_urls = allocator.reserve(100)
+        self.assertEqual(len(set(short_urls)), 100)
+        for short_url in short_urls:
+            self.assertEqual(len(short_url), test_settings.TINYLINK_LENGTH)
+        sequence = ShortUrlSequence.objects.get(length=test_settings.TINYLINK_LENGTH)
+        self.assertEqual(sequence.next_value, 100)
+        self.assertEqual(
+            unpermute(decode(short_urls[42]), sequence.length, sequence.key), 42
+        )
+
+    @override_settings(TINYLINK_LENGTH=1)
+    def test_length_grows(self):
+        allocator = ShortUrlAllocator()
+        self.assertEqual(len(allocator.reserve(len(ALPHABET) + 1)), len(ALPHABET))
+        short_urls = allocator.reserve(2)
+        self.assertEqual([len(short_url) for short_url in short_urls], [2, 2])
+
+    def test_save_allocates_short_url(self):
+        with patch(
+            "tinylinks.allocator.ShortUrlAllocator.allocate",
+            side_effect=["vB7f5b", "a1b2c"],
+        ):
+            Tinylink.objects.create(long_url="http://example.com/", short_url="vB7f5b")
+            link = Tinylink.objects.create(long_url="http://example.com/2")
+        self.assertEqual(link.short_url, "a1b2c")
+
+    def test_serializer(self):
+        serializer = TinylinkSerializer(data={"long_url": "http://example.com/"})
+        self.assertTrue(serializer.is_valid())
+        link = serializer.save()
+        self.assertEqual(len(link.short_url), test_settings.TINYLINK_LENGTH)
+        self.assertTrue(set(link.short_url) <= set(ALPHABET))
+
+
+class ShortUrlBlockTest(TransactionTestCase):
+    def test_blocks(self):
+        allocator = ShortUrlAllocator(block_size=10)
+        with patch.object(allocator, "reserve", wraps=allocator.reserve) as reserve:
+            short_urls = [allocator.allocate() for i in range(15)]
+            self.assertEqual(reserve.call_count, 2)
+            short_urls += allocator.allocate_many(30)
+            self.assertEqual(reserve.call_count, 3)
+        self.assertEqual(len(set(short_urls)), 45)
+        self.assertEqual(ShortUrlSequence.objects.get().next_value, 45)
+
+    def test_no_blocks_in_transactions(self):
+        allocator = ShortUrlAllocator(block_size=10)
+        with transaction.atomic():
+            allocator.allocate()
+        self.assertEqual(ShortUrlSequence.objects.get().next_value, 1)
+
+    def test_forked_process(self):
+        allocator = ShortUrlAllocator(block_size=10)
+        short_url = allocator.allocate()
+        allocator._pid = None
+        self.assertNotIn(short_url, allocator.allocate_many(10))
+        self.assertEqual(ShortUrlSequence.objects.get().next_value, 20)
+
+
+class TinylinkBulkTest(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="user", password="test1234")
+        self.link = Tinylink.objects.create(
+            user=self.user,
+            long_url="http://www.example.com/thisisalongURL",
+            short_url="vB7f5b",
+        )
+        self.url = reverse("tinylink-bulk")
+        self.client.force_authenticate(user=self.user)
+
+    def test_bulk_create(self):
+        long_urls = ["http://example.com/{}".format(i) for i in range(50)]
+        long_urls.insert(10, self.link.long_url)
+        long_urls.append("http://example.com/3")
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(
+                self.url, {"long_urls": long_urls}, format="json"
+            )
+        inserts = [
+            query
+            for query in queries
+            if query["sql"].startswith("INSERT")
+            and '"tinylinks_tinylink"' in query["sql"]
+        ]
+        self.assertEqual(len(inserts), 1)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        data = response.json()
+        self.assertEqual(list(data), long_urls[:-1])
+        self.assertEqual(data[self.link.long_url], "http://testserver/vB7f5b")
+        self.assertEqual(Tinylink.objects.filter(user=self.user).count(), 51)
+        link = Tinylink.objects.get(long_url="http://example.com/3")
+        self.assertEqual(data[link.long_url], "http://testserver/" + link.short_url)
+
+    def test_short_url_collision(self):
+        with patch(
+            "tinylinks.upsert.short_url_allocator.allocate_many",
+            side_effect=[["vB7f5b"], ["a1b2c"]],
+        ):
+            response = self.client.post(
+                self.url, {"long_urls": ["http://example.com/"]}, format="json"
+            )
+        self.assertEqual(
+            response.json(), {"http://example.com/": "http://testserver/a1b2c"}
+        )
+
+    def test_invalid_scheme(self):
+        response = self.client.post(
+            self.url, {"long_urls": ["javascript:alert(1)"]}, format="json"
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn("long_urls", response.json())
+
+    @override_settings(TINYLINK_BULK_MAX_SIZE=2)
+    def test_max_size(self):
+        long_urls = ["http://example.com/{}".format(i) for i in range(3)]
+        response = self.client.post(self.url, {"long_urls": long_urls}, format="json")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn("long_urls", response.json())
+
+    @patch("tinylinks.upsert.CHUNK_SIZE", 20)
+    def test_chunked_lookup(self):
+        long_urls = ["http://example.com/{}".format(i) for i in range(50)]
+        long_urls.append(self.link.long_url)
+        tinylinks, created = upsert_tinylinks(long_urls, self.user)
+        self.assertEqual(len(created), 50)
+        self.assertEqual(tinylinks[self.link.long_url], self.link)
+
+
+class CanonicalUrlTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="user", password="test1234")
+
+    def test_canonicalize_url(self):
+        canonical = "http://example.com/a?a=2&b=1"
+        for url in (
+            "http://Example.com/a?b=1&a=2",
+            "http://example.com/a?a=2&b=1",
+            "HTTP://example.com:80/a/?b=1&a=2",
+            "http://example.com/%61?a=2&b=1",
+        ):
+            self.assertEqual(canonicalize_url(url), canonical)
+        self.assertEqual(canonicalize_url("http://example.com"), "http://example.com/")
+        self.assertEqual(
+            canonicalize_url("https://user@example.com:8443/%c3%a4"),
+            "https://user@example.com:8443/%C3%A4",
+        )
+        self.assertEqual(canonicalize_url("not a url"), "not a url")
+        self.assertEqual(
+            canonicalize_url("HTTPS://app.example.com:443/#/orders"),
+            "https://app.example.com/#/orders",
+        )
+
+    def test_fragments_are_distinct(self):
+        orders, created = upsert_tinylink("https://app.example.com/#/orders", self.user)
+        profile, created = upsert_tinylink(
+            "https://app.example.com/#/profile", self.user
+        )
+        self.assertTrue(created)
+        self.assertNotEqual(orders, profile)
+        self.assertEqual(profile.long_url, "https://app.example.com/#/profile")
+
+    @override_settings(TINYLINK_URL_CANONICALIZER="builtins.str")
+    def test_custom_canonicalizer(self):
+        self.assertNotEqual(
+            hash_long_url("http://example.com/a/"),
+            hash_long_url("http://example.com/a"),
+        )
+
+    def test_brothers(self):
+        link = Tinylink.objects.create(
+            user=self.user, long_url="http://Example.com/a?b=1&a=2"
+        )
+        serializer = TinylinkSerializer(
+            data={"long_url": "http://example.com/a/?a=2&b=1"},
+            context={"user": self.user},
+        )
+        self.assertTrue(serializer.is_valid())
+        self.assertEqual(serializer.save(), link)
+        self.assertEqual(link.long_url, "http://Example.com/a?b=1&a=2")
+
+    def test_merge_duplicates(self):
+        links = [
+            Tinylink.objects.create(user=self.user, long_url=url, amount_of_views=2)
+            for url in ("http://example.com/a", "http://example.com/a/", "http://x.org")
+        ]
+        TinylinkLog.objects.create(
+            tinylink=links[1], user_agent="test", remote_ip="127.0.0.1"
+        )
+        # Duplicates created before the canonicalization.
+        Tinylink.objects.filter(pk=links[1].pk).update(long_url_hash="old")
+        call_command("merge_duplicate_tinylinks", stdout=Mock())
+        for link in links:
+            link.refresh_from_db()
+        self.assertEqual(links[0].amount_of_views, 4)
+        self.assertEqual(links[1].amount_of_views, 0)
+        self.assertIsNone(links[1].long_url_hash)
+        self.assertEqual(links[2].amount_of_views, 2)
+        self.assertEqual(TinylinkLog.objects.get().tinylink, links[0])
+        self.assertEqual(
+            lookup_tinylink(links[1].short_url).long_url, links[1].long_url
+        )
+
+    def test_merge_keeps_oldest(self):
+        old = Tinylink.objects.create(
+            user=self.user, long_url="http://example.com/a/", amount_of_views=2
+        )
+        # The older tinylink has been hashed before the canonicalization.
+        Tinylink.objects.filter(pk=old.pk).update(long_url_hash="old")
+        new = Tinylink.objects.create(
+            user=self.user, long_url="http://example.com/a", amount_of_views=2
+        )
+        TinylinkLog.objects.create(
+            tinylink=new, user_agent="test", remote_ip="127.0.0.1"
+        )
+        call_command("merge_duplicate_tinylinks", stdout=Mock())
+        old.refresh_from_db()
+        new.refresh_from_db()
+        self.assertEqual(old.amount_of_views, 4)
+        self.assertEqual(old.long_url_hash, hash_long_url(old.long_url))
+        self.assertEqual(new.amount_of_views, 0)
+        self.assertIsNone(new.long_url_hash)
+        self.assertEqual(TinylinkLog.objects.get().tinylink, old)
+
+
+class UpsertTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="user", password="test1234")
+
+    def test_upsert_tinylink(self):
+        link, created = upsert_tinylink("http://example.com/a", self.user)
+        self.assertTrue(created)
+        self.assertEqual(link.long_url_hash, hash_long_url("http://example.com/a"))
+        with CaptureQueriesContext(connection) as queries:
+            same, created = upsert_tinylink("HTTP://example.com/a/", self.user)
+        # The insert is skipped and the tinylink is read back.
+        queries = [q["sql"] for q in queries if '"tinylinks_tinylink"' in q["sql"]]
+        self.assertEqual(len(queries), 2)
+        self.assertFalse(created)
+        self.assertEqual(same, link)
+        self.assertEqual(Tinylink.objects.count(), 1)
+
+    def test_upsert_without_user(self):
+        link, created = upsert_tinylink("http://example.com/a")
+        self.assertTrue(created)
+        self.assertEqual(upsert_tinylink("http://example.com/a"), (link, False))
+        self.assertEqual(Tinylink.objects.count(), 1)
+
+    def test_upsert_tinylinks(self):
+        link = Tinylink.objects.create(user=self.user, long_url="http://example.com/a")
+        urls = ["http://example.com/a/", "http://example.com/b", "http://example.com/b"]
+        tinylinks, created = upsert_tinylinks(urls, self.user)
+        self.assertEqual(tinylinks[urls[0]], link)
+        self.assertEqual(created, {tinylinks[urls[1]]})
+        self.assertEqual(Tinylink.objects.count(), 2)
+
+    def test_custom_short_url_alias(self):
+        link = Tinylink.objects.create(user=self.user, long_url="http://example.com/a")
+        alias = Tinylink.objects.create(
+            user=self.user, long_url="http://example.com/a", short_url="custom"
+        )
+        self.assertIsNone(alias.long_url_hash)
+        self.assertEqual(upsert_tinylink("http://example.com/a", self.user)[0], link)
+
+    def test_change_user(self):
+        other = User.objects.create_user(username="other", password="test1234")
+        link = Tinylink.objects.create(user=self.user, long_url="http://example.com/a")
+        moved = Tinylink.objects.create(user=other, long_url="http://example.com/a/")
+        moved = Tinylink.objects.get(pk=moved.pk)
+        moved.user = self.user
+        moved.save()
+        self.assertIsNone(moved.long_url_hash)
+        self.assertEqual(upsert_tinylink("http://example.com/a", self.user)[0], link)
+        # Moved back, it is found by its long URL again.
+        moved = Tinylink.objects.get(pk=moved.pk)
+        moved.user = other
+        moved.save()
+        self.assertEqual(upsert_tinylink("http://example.com/a", other)[0], moved)
+
+    def test_concurrent_brother(self):
+        link = Tinylink.objects.create(user=self.user, long_url="http://example.com/a")
+        # The other tinylink is created after the check for brothers.
+        with patch.object(Tinylink, "_has_brother", side_effect=[False, True]):
+            alias = Tinylink.objects.create(
+                user=self.user, long_url="http://example.com/a"
+            )
+        self.assertIsNone(alias.long_url_hash)
+        self.assertEqual(upsert_tinylink("http://example.com/a", self.user)[0], link)
+
+    def test_form_returns_existing_tinylink(self):
+        link = Tinylink.objects.create(user=self.user, long_url="http://example.com/a")
+        form = TinylinkForm(data={"long_url": "http://example.com/a/"}, user=self.user)
+        self.assertTrue(form.is_valid())
+        self.assertEqual(form.save(), link)
+        self.assertFalse(ValidationJob.objects.exists())
+        form = TinylinkForm(data={"long_url": "http://example.com/b"}, user=self.user)
+        self.assertTrue(form.is_valid())
+        new_link = form.save()
+        self.assertNotEqual(new_link, link)
+        self.assertEqual(ValidationJob.objects.get().tinylink, new_link)
+
+
+class LinkClientTest(TestCase):
+    def test_shared_pool(self):
+        client = LinkClient(num_pools=3, maxsize=4)
+        pool = client.pool
+        self.assertIs(client.pool, pool)
+        self.assertEqual(pool.connection_pool_kw["maxsize"], 4)
+        self.assertIn(
+            (socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1),
+            pool.connection_pool_kw["socket_options"],
+        )
+        with patch("tinylinks.client.os.getpid", return_value=-1):
+            self.assertIsNot(client.pool, pool)
+
+    def test_without_keep_alive(self):
+        pool = LinkClient(keep_alive=False).pool
+        self.assertEqual(pool.headers, {"Connection": "close"})
+
+    @patch("tinylinks.models.get_url_response")
+    def test_validations_share_the_pool(self, mock_fn):
+        mock_fn.return_value = Mock(status=200, headers={})
+        link = Tinylink.objects.create(long_url="http://example.com/a")
+        validate_long_url(link)
+        validate_long_url(link)
+        pools = {call.args[0] for call in mock_fn.call_args_list}
+        self.assertEqual(pools, {link_client.pool})
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    lock = threading.Lock()
+    active = 0
+    max_active = 0
+    requests = []
+    headers = []
+
+    redirects = {
+        "/redirect": (302, "/ok"),
+        "/chain": (301, "/chain/2"),
+        "/chain/2": (307, "/chain/3"),
+        "/chain/3": (308, "/ok"),
+        "/loop": (302, "/loop"),
+    }
+
+    def do_HEAD(self):
+        self.respond(body=False)
+
+    def do_GET(self):
+        self.respond(body=True)
+
+    def respond(self, body):
+        cls = type(self)
+        with cls.lock:
+            cls.active += 1
+            cls.max_active = max(cls.max_active, cls.active)
+            cls.requests.append((self.command, self.path))
+            cls.headers.append(self.headers)
+        try:
+            if self.path.startswith("/slow"):
+                time.sleep(0.05)
+            status, headers, length = self.route(body)
+            self.send_response(status)
+            for name, value in headers.items():
+                self.send_header(name, value)
+            self.send_header("Content-Length", str(length))
+            self.end_headers()
+            if body and length:
+                chunk = b"x" * 65536
+                for _ in range(length // len(chunk)):
+                    self.wfile.write(chunk)
+        except (ConnectionError, OSError):
+            pass
+        finally:
+            with cls.lock:
+                cls.active -= 1
+
+    def route(self, body):
+        if self.path in self.redirects:
+            status, location = self.redirects[self.path]
+            return status, {"Location": location}, 0
+        if self.path.startswith(("/nohead", "/large")) and not body:
+            return 405, {}, 0
+        if self.path.startswith("/deep/"):
+            depth = int(self.path.split("/")[-1])
+            return 302, {"Location": "/deep/{}".format(depth + 1)}, 0
+        if self.path.startswith("/cookie"):
+            if "session=1" in self.headers.get("Cookie", ""):
+                return 200, {}, 0
+            return 302, {"Set-Cookie": "session=1; Path=/", "Location": "/cookie"}, 0
+        if self.path.startswith("/etag"):
+            if self.headers.get("If-None-Match") == '"v1"':
+                return 304, {}, 0
+            return (
+                200,
+                {"ETag": '"v1"', "Last-Modified": "Sun, 18 Oct 2026 09:00:00 GMT"},
+                0,
+            )
+        if self.path.startswith("/large"):
+            return 200, {}, 50 * 1024 * 1024
+        if self.path.startswith(("/ok", "/slow", "/nohead")):
+            return 200, {}, 0
+        return 404, {}, 0
+
+    def log_message(self, *args):
+        pass
+
+
+class LinkCheckerTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.server = ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        cls.base_url = "http://127.0.0.1:{}".format(cls.server.server_port)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        super().tearDownClass()
+
+    def create_link(self, path):
+        return Tinylink.objects.create(
+            long_url=self.base_url + path, validation_error="old"
+        )
+
+    def test_check(self):
+        ok = self.create_link("/ok")
+        redirect = self.create_link("/redirect")
+        missing = self.create_link("/missing")
+        broken = self.create_link("/ok")
+        broken.long_url = "http://[broken"
+        with self.assertNumQueries(2):
+            # Counting the recent clicks and saving the results.
+            LinkChecker(concurrency=4, per_host=2).check(
+                [ok, redirect, missing, broken]
+            )
+        for link in (ok, redirect, missing, broken):
+            link.refresh_from_db()
+        self.assertFalse(ok.is_broken)
+        self.assertFalse(redirect.is_broken)
+        self.assertTrue(missing.is_broken)
+        self.assertEqual(missing.validation_error, "URL not accessible.")
+        self.assertTrue(broken.is_broken)
+        self.assertNotEqual(broken.validation_error, "old")
+
+    def test_per_host_limit(self):
+        StubHandler.max_active = 0
+        links = [self.create_link("/slow/{}".format(i)) for i in range(8)]
+        LinkChecker(concurrency=8, per_host=2).check(links)
+        self.assertLessEqual(StubHandler.max_active, 2)
+        self.assertFalse(any(link.is_broken for link in links))
+
+    def test_redirects(self):
+        links = [
+            self.create_link(path)
+            for path in ("/chain", "/cookie", "/loop", "/deep/0", "/redirect")
+        ]
+        LinkChecker().check(links)
+        chain, cookie, loop, deep, redirect = links
+        self.assertFalse(chain.is_broken)
+        self.assertEqual(chain.redirect_location, self.base_url + "/ok")
+        self.assertEqual(chain.redirect_count, 3)
+        self.assertFalse(cookie.is_broken)
+        self.assertEqual(cookie.redirect_count, 1)
+        self.assertTrue(loop.is_broken)
+        self.assertEqual(loop.validation_error, "Redirect loop.")
+        self.assertTrue(deep.is_broken)
+        self.assertEqual(deep.validation_error, "Too many redirects.")
+        self.assertFalse(redirect.is_broken)
+        self.assertEqual(redirect.redirect_count, 1)
+
+    def test_conditional_check(self):
+        link = self.create_link("/etag")
+        LinkChecker().check([link])
+        link.refresh_from_db()
+        self.assertFalse(link.is_broken)
+        self.assertEqual(link.etag, '"v1"')
+        self.assertEqual(link.last_modified, "Sun, 18 Oct 2026 09:00:00 GMT")
+        StubHandler.headers = []
+        LinkChecker().check([link])
+        self.assertFalse(link.is_broken)
+        self.assertEqual(StubHandler.headers[0]["If-None-Match"], '"v1"')
+        self.assertEqual(link.etag, '"v1"')
+        link.long_url = self.base_url + "/ok"
+        link.save()
+        self.assertEqual(link.etag, "")
+
+    def test_head_first(self):
+        StubHandler.requests = []
+        links = [self.create_link(path) for path in ("/ok", "/nohead", "/large")]
+        LinkChecker().check(links)
+        self.assertFalse(any(link.is_broken for link in links))
+        self.assertEqual(
+            sorted(StubHandler.requests),
+            [
+                ("GET", "/large"),
+                ("GET", "/nohead"),
+                ("HEAD", "/large"),
+                ("HEAD", "/nohead"),
+                ("HEAD", "/ok"),
+            ],
+        )
+
+    def test_host_breaker(self):
+        with socket.socket() as sock:
+            sock.bind(("127.0.0.1", 0))
+            # Nothing listens on the port, so connections are refused.
+            port = sock.getsockname()[1]
+        links = [
+            Tinylink.objects.create(long_url="http://127.0.0.1:{}/{}".format(port, i))
+            for i in range(5)
+        ]
+        breaker = HostBreaker(failures=2, cooldown=60)
+        LinkChecker(per_host=1, breaker=breaker).check(links)
+        self.assertTrue(all(link.is_broken for link in links))
+        skipped = [
+            link
+            for link in links
+            if link.validation_error == "Skipped, the host failed repeatedly."
+        ]
+        self.assertEqual(len(skipped), 3)
+        ok = self.create_link("/ok")
+        LinkChecker(breaker=breaker).check([ok])
+        self.assertFalse(ok.is_broken)
+
+    def test_unknown_hosts(self):
+        links = [
+            Tinylink.objects.create(long_url="http://unknown.invalid/{}".format(i))
+            for i in range(3)
+        ]
+        breaker = HostBreaker(failures=10)
+        with patch("socket.getaddrinfo", side_effect=socket.gaierror) as lookup:
+            LinkChecker(breaker=breaker).check(links)
+        self.assertEqual(lookup.call_count, 1)
+        for link in links:
+            link.refresh_from_db()
+            self.assertTrue(link.is_broken)
+            self.assertEqual(link.validation_error, "Host not found.")
+
+    def test_command(self):
+        links = [self.create_link("/ok") for _ in range(4)]
+        Tinylink.objects.update(is_broken=True)
+        Tinylink.objects.filter(pk=links[0].pk).update(
+            next_check=timezone.now() + datetime.timedelta(hours=1)
+        )
+        with self.assertNumQueries(3):
+            # Reading the due tinylinks, counting their clicks and saving them.
+            call_command(
+                "check_tinylink_targets", "--concurrency=2", "--limit=2", stdout=Mock()
+            )
+        self.assertEqual(Tinylink.objects.filter(is_broken=False).count(), 2)
+        self.assertTrue(Tinylink.objects.get(pk=links[0].pk).is_broken)
+        call_command("check_tinylink_targets", stdout=Mock())
+        self.assertEqual(Tinylink.objects.filter(is_broken=False).count(), 3)
+
+
+class ValidationJobTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_superuser(
+            username="user", email="user@example.com", password="test1234"
+        )
+        self.link = Tinylink.objects.create(
+            user=self.user, long_url="http://example.com/a", is_broken=False
+        )
+
+    def test_enqueue(self):
+        enqueue_validation([self.link])
+        self.assertFalse(self.link.is_broken)
+        enqueue_validation([self.link], long_url_changed=True)
+        self.assertIsNone(self.link.is_broken)
+        self.link.refresh_from_db()
+        self.assertIsNone(self.link.is_broken)
+        self.assertEqual(ValidationJob.objects.get().tinylink, self.link)
+
+    def test_enqueue_new_tinylinks(self):
+        links, created = upsert_tinylinks(["http://example.com/b"], self.user)
+        with CaptureQueriesContext(connection) as queries:
+            enqueue_validation(created)
+        self.assertFalse(
+            any(q["sql"].startswith('UPDATE "tinylinks_tinylink"') for q in queries)
+        )
+        self.assertEqual(ValidationJob.objects.count(), 1)
+
+    def test_api_update_validates_changed_long_url(self):
+        self.client.force_login(user=self.user)
+        url = reverse("tinylink-detail", kwargs={"pk": self.link.pk})
+        response = self.client.patch(
+            url, {"cache_max_age": 60}, content_type="application/json"
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertFalse(ValidationJob.objects.exists())
+        response = self.client.patch(
+            url,
+            {"long_url": "http://example.com/changed"},
+            content_type="application/json",
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIsNone(Tinylink.objects.get(pk=self.link.pk).is_broken)
+        self.assertTrue(ValidationJob.objects.filter(tinylink=self.link).exists())
+
+    def test_create_does_not_validate(self):
+        with patch("tinylinks.models.get_url_response") as mock_fn:
+            form = TinylinkForm(data={"long_url": "http://example.com/b"})
+            self.assertTrue(form.is_valid())
+            link = form.save()
+        self.assertFalse(mock_fn.called)
+        self.assertIsNone(Tinylink.objects.get(pk=link.pk).is_broken)
+        self.assertTrue(ValidationJob.objects.filter(tinylink=link).exists())
+
+    def test_edit_validates_changed_long_url(self):
+        form = TinylinkForm(
+            user=self.user,
+            mode="change-short",
+            instance=self.link,
+            data={"long_url": self.link.long_url, "short_url": "renamed"},
+        )
+        self.assertTrue(form.is_valid(), form.errors)
+        form.save()
+        self.link.refresh_from_db()
+        self.assertFalse(self.link.is_broken)
+        self.assertFalse(ValidationJob.objects.exists())
+        form = TinylinkForm(
+            user=self.user,
+            mode="change-long",
+            instance=self.link,
+            data={"long_url": "http://example.com/changed", "short_url": "renamed"},
+        )
+        self.assertTrue(form.is_valid(), form.errors)
+        form.save()
+        self.assertIsNone(Tinylink.objects.get(pk=self.link.pk).is_broken)
+        self.assertTrue(ValidationJob.objects.filter(tinylink=self.link).exists())
+
+    def test_validate_button(self):
+        self.client.force_login(user=self.user)
+        self.client.post(
+            reverse("tinylink_list"), data={"validate{}".format(self.link.pk): 1}
+        )
+        self.assertTrue(ValidationJob.objects.filter(tinylink=self.link).exists())
+
+    @patch("socket.getaddrinfo", return_value=[])
+    @patch("tinylinks.models.get_url_response")
+    def test_process(self, mock_fn, lookup):
+        mock_fn.return_value = Mock(status=200, headers={})
+        broken = Tinylink.objects.create(long_url="http://example.com/b")
+        enqueue_validation([self.link, broken])
+        self.assertEqual(process_validation_jobs(batch_size=1), 1)
+        self.assertEqual(ValidationJob.objects.count(), 1)
+        call_command("process_validation_jobs", "--once", stdout=Mock())
+        self.assertFalse(ValidationJob.objects.exists())
+        self.link.refresh_from_db()
+        broken.refresh_from_db()
+        self.assertFalse(self.link.is_broken)
+        self.assertFalse(broken.is_broken)
+
+    @patch("socket.getaddrinfo", return_value=[])
+    @patch("tinylinks.models.get_url_response")
+    def test_enqueued_again_while_checked(self, mock_fn, lookup):
+        mock_fn.return_value = Mock(status=200, headers={})
+        enqueue_validation([self.link])
+        ValidationJob.objects.update(
+            enqueued=timezone.now() + datetime.timedelta(minutes=1)
+        )
+        process_validation_jobs()
+        self.assertTrue(ValidationJob.objects.exists())
+
+
+class OpenUrlTest(TestCase):
+    def test_head(self):
+        pool = Mock()
+        pool.urlopen.return_value = Mock(status=200)
+        self.assertEqual(open_url(pool, "http://example.com", timeout=1).status, 200)
+        pool.urlopen.assert_called_once_with(
+            "HEAD", "http://example.com", timeout=1, preload_content=False
+        )
+
+    def test_large_body_is_not_read(self):
+        pool = Mock()
+        head = Mock(status=405)
+        get = Mock(status=200, headers={"Content-Length": str(10**9)})
+        pool.urlopen.side_effect = [head, get]
+        self.assertIs(open_url(pool, "http://example.com"), get)
+        self.assertEqual(pool.urlopen.call_args.args[0], "GET")
+        self.assertTrue(get.close.called)
+        self.assertFalse(get.read.called)
+        self.assertTrue(get.release_conn.called)
+
+    def test_short_body_is_drained(self):
+        pool = Mock()
+        get = Mock(status=200, headers={"Content-Length": "12"})
+        pool.urlopen.return_value = get
+        open_url(pool, "http://example.com", method="GET")
+        self.assertTrue(get.drain_conn.called)
+        self.assertFalse(get.close.called)
+
+
+class HostBreakerTest(TestCase):
+    @patch("tinylinks.checker.time.monotonic")
+    def test_cooldown(self, monotonic):
+        monotonic.return_value = 100
+        breaker = HostBreaker(failures=2, cooldown=10)
+        breaker.record("example.com", success=False)
+        self.assertFalse(breaker.is_open("example.com"))
+        breaker.record("example.com", success=False)
+        self.assertTrue(breaker.is_open("example.com"))
+        self.assertFalse(breaker.is_open("example.org"))
+        monotonic.return_value = 111
+        self.assertFalse(breaker.is_open("example.com"))
+        breaker.record("example.com", success=False)
+        self.assertTrue(breaker.is_open("example.com"))
+        breaker.record("example.com", success=True)
+        self.assertFalse(breaker.is_open("example.com"))
+
+
+@override_settings(TINYLINK_CHECK_INTERVAL=10, TINYLINK_CHECK_PERIOD=300)
+class SchedulerTest(TestCase):
+    def setUp(self):
+        self.link = Tinylink.objects.create(long_url="http://example.com/a")
+
+    def test_check_interval(self):
+        minutes = datetime.timedelta(minutes=1)
+        self.assertEqual(get_check_interval(self.link), 600 * minutes)
+        self.link.amount_of_views = 5
+        self.assertEqual(get_check_interval(self.link), 300 * minutes)
+        self.assertEqual(get_check_interval(self.link, recent_clicks=1), 150 * minutes)
+        self.assertEqual(
+            get_check_interval(self.link, recent_clicks=2**40), 10 * minutes
+        )
+        self.link.check_failures = 3
+        self.assertEqual(get_check_interval(self.link, recent_clicks=1), 40 * minutes)
+        self.link.check_failures = 100
+        self.assertEqual(get_check_interval(self.link), 2400 * minutes)
+
+    def test_schedule_checks(self):
+        now = timezone.now()
+        clicked = Tinylink.objects.create(long_url="http://example.com/b")
+        TinylinkLog.objects.create(
+            tinylink=clicked, user_agent="test", remote_ip="127.0.0.1"
+        )
+        self.link.is_broken = True
+        clicked.is_broken = False
+        with self.assertNumQueries(1):
+            schedule_checks([self.link, clicked], now=now)
+        self.assertEqual(self.link.check_failures, 1)
+        self.assertEqual(self.link.next_check, now + datetime.timedelta(minutes=10))
+        self.assertEqual(clicked.check_failures, 0)
+        self.assertEqual(clicked.next_check, now + datetime.timedelta(minutes=150))
+
+    def test_due_tinylinks(self):
+        Tinylink.objects.create(
+            long_url="http://example.com/b",
+            next_check=timezone.now() + datetime.timedelta(minutes=1),
+        )
+        overdue = Tinylink.objects.create(
+            long_url="http://example.com/c",
+            next_check=timezone.now() - datetime.timedelta(minutes=1),
+        )
+        self.assertEqual(list(due_tinylinks()), [overdue, self.link])
+        enqueue_validation([overdue])
+        self.assertEqual(list(due_tinylinks()), [self.link])
+
+
+class ClaimTest(TestCase):
+    def setUp(self):
+        past = timezone.now() - datetime.timedelta(minutes=1)
+        self.links = [
+            Tinylink.objects.create(
+                long_url="http://example.com/{}".format(i),
+                next_check=past - datetime.timedelta(minutes=i),
+            )
+            for i in range(5)
+        ]
+
+    def test_claims_are_disjoint(self):
+        calls = []
+        others = []
+
+        def due(now=None):
+            calls.append(now)
+            if len(calls) == 2:
+                # Another worker claims the same rows between reading and
+                # leasing them.
+                others.extend(claim_due_tinylinks(2, now=now))
+            return due_tinylinks(now)
+
+        with patch("tinylinks.scheduler.due_tinylinks", side_effect=due):
+            claimed = claim_due_tinylinks(2)
+        self.assertEqual(others, [self.links[4], self.links[3]])
+        self.assertEqual(claimed, [self.links[2], self.links[1]])
+        self.assertNotEqual(claimed[0].lease_owner, others[0].lease_owner)
+        self.assertEqual(list(due_tinylinks()), [self.links[0]])
+
+    @skipUnlessDBFeature("has_select_for_update_skip_locked")
+    def test_skip_locked(self):
+        claimed = claim_due_tinylinks(3)
+        self.assertEqual(len(claimed), 3)
+        self.assertEqual(len(claim_due_tinylinks(10)), 2)
+
+    def test_expired_lease(self):
+        claimed = claim_due_tinylinks(5, lease=60)
+        self.assertEqual(claim_due_tinylinks(5), [])
+        later = timezone.now() + datetime.timedelta(minutes=2)
+        self.assertEqual(len(claim_due_tinylinks(5, now=later)), len(claimed))
+
+    def test_claimed_elsewhere_meanwhile(self):
+        calls = []
+
+        def due(now=None):
+            calls.append(now)
+            if len(calls) == 2:
+                # Another worker claims the rows between reading and leasing.
+                pks = [link.pk for link in self.links[3:]]
+                Tinylink.objects.filter(pk__in=pks).update(
+                    lease_until=timezone.now() + datetime.timedelta(minutes=5)
+                )
+            return due_tinylinks(now)
+
+        with patch("tinylinks.scheduler.due_tinylinks", side_effect=due):
+            claimed = claim_due_tinylinks(2)
+        self.assertEqual(claimed, [self.links[2], self.links[1]])
+
+    @patch("socket.getaddrinfo", return_value=[])
+    @patch("tinylinks.models.get_url_response")
+    def test_command(self, mock_fn, lookup):
+        mock_fn.return_value = Mock(status=200, headers={})
+        call_command("check_tinylink_targets", "--claim", "--limit=3", stdout=Mock())
+        self.assertEqual(mock_fn.call_count, 3)
+        self.assertFalse(Tinylink.objects.filter(lease_until__isnull=False).exists())
+        self.assertEqual(len(due_tinylinks()), 2)
+
+    @override_settings(TINYLINK_CHECK_INTERVAL=0)
+    def test_run_without_claim_stops_after_interval(self):
+        checker = Mock(batch_size=2, check=lambda links: links)
+        self.assertEqual(CheckCommand().check_due(checker, limit=None), 2)
+
+    @patch("socket.getaddrinfo", return_value=[])
+    @patch("tinylinks.models.get_url_response")
+    def test_release_keeps_leases_of_other_workers(self, mock_fn, lookup):
+        mock_fn.return_value = Mock(status=200, headers={})
+        slow = claim_due_tinylinks(5, lease=60)
+        later = timezone.now() + datetime.timedelta(minutes=2)
+        claimed = claim_due_tinylinks(2, now=later)
+        # The slow worker finishes after its lease expired.
+        LinkChecker().check(slow)
+        release_tinylinks(slow)
+        self.assertEqual(
+            set(Tinylink.objects.exclude(lease_owner="").values_list("pk", flat=True)),
+            {link.pk for link in claimed},
+        )
+        release_tinylinks(claimed)
+        self.assertFalse(Tinylink.objects.filter(lease_until__isnull=False).exists())
@@ -0,0 +1,88 @@
+"""Creation of deduplicated tinylinks for the ``django-tinylinks`` app."""
+from tinylinks.allocator import short_url_allocator
+from tinylinks.bloom import announce_short_urls
+from tinylinks.buffers import CHUNK_SIZE
+from tinylinks.cache import invalidate_short_urls
+from tinylinks.jobs import enqueue_validation
+from tinylinks.models import Tinylink, hash_long_url
+
+
+def upsert_tinylinks(long_urls, user=None):
+    """
+    Returns a dictionary of ``long_urls`` and the tinylinks of ``user`` for
+    them in the given order and the set of newly created tinylinks.
+
+    The tinylinks are inserted with ``ignore_conflicts``, so the unique
+    ``(user, long_url_hash)`` constraint makes the database skip long URLs
+    the user already has a tinylink for. All tinylinks are read back in
+    chunks of ``CHUNK_SIZE`` hashes. Tinylinks without a user aren't covered by the constraint,
+    so existing ones are looked up first. The validation of the new
+    tinylinks is queued.
+
+    """
+    hashes = {long_url: hash_long_url(long_url) for long_url in long_urls}
+    # Canonically equal long URLs share a tinylink.
+    pending = {}
+    for long_url, long_url_hash in hashes.items():
+        pending.setdefault(long_url_hash, long_url)
+    by_hash = {}
+    if user is None:
+        by_hash = _get_tinylinks(user, pending)
+        pending = {h: url for h, url in pending.items() if h not in by_hash}
+
+    created = set()
+    while pending:
+        short_urls = short_url_allocator.allocate_many(len(pending))
+        Tinylink.objects.bulk_create(
+            [
+                Tinylink(
+                    user=user,
+                    long_url=long_url,
+                    long_url_hash=long_url_hash,
+                    short_url=short_url,
+                )
+                for (long_url_hash, long_url), short_url in zip(
+                    pending.items(), short_urls
+                )
+            ],
+            batch_size=CHUNK_SIZE,
+            ignore_conflicts=True,
+        )
+        tinylinks = _get_tinylinks(user, pending)
+        short_urls = set(short_urls)
+        created.update(t for t in tinylinks.values() if t.short_url in short_urls)
+        by_hash.update(tinylinks)
+        # Long URLs whose short URL has been chosen by hand or by the random
+        # generator of earlier versions are inserted again.
+        pending = {h: url for h, url in pending.items() if h not in by_hash}
+
+    if created:
+        short_urls = [tinylink.short_url for tinylink in created]
+        invalidate_short_urls(short_urls)
+        announce_short_urls(short_urls)
+        enqueue_validation(created)
+    tinylinks = {long_url: by_hash[hashes[long_url]] for long_url in long_urls}
+    return tinylinks, created
+
+
+def upsert_tinylink(long_url, user=None):
+    """
+    Returns the tinylink of ``user`` for ``long_url`` and whether it has
+    been created.
+
+    """
+    tinylinks, created = upsert_tinylinks([long_url], user)
+    tinylink = tinylinks[long_url]
+    return tinylink, tinylink in created
+
+
+def _get_tinylinks(user, hashes):
+    tinylinks = {}
+    hashes = list(hashes)
+    for i in range(0, len(hashes), CHUNK_SIZE):
+        rows = Tinylink.objects.filter(
+            user=user, long_url_hash__in=hashes[i : i + CHUNK_SIZE]
+        )
+        for tinylink in rows.order_by("pk"):
+            tinylinks.setdefault(tinylink.long_url_hash, tinylink)
+    return tinylinks
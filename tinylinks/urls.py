@@ -7,8 +7,10 @@ from tinylinks.router import CustomDefaultRouter
 from tinylinks.views import (ShorterURL, StatisticsView, TinylinkCreateView,
                              TinylinkDeleteView, TinylinkListView,
                              TinylinkRedirectView, TinylinkUpdateView,
-                             TinylinkViewSet, UserViewSet, db_stats, stats,
-                             tinylink_expand, tinylink_stats)
+                             TinylinkViewSet, UserViewSet, bloom_stats,
+                             db_stats, ingest_clicks, latency_stats, stats,
+                             tinylink_expand, tinylink_expand_async,
+                             tinylink_redirect_async, tinylink_stats)
 
 # Create router and register our API viewsets with it.
 router = CustomDefaultRouter()
@@ -19,6 +21,13 @@ router.register(r"users", UserViewSet)
 
 PREFIX = getattr(settings, "TINYLINK_SHORT_URL_PREFIX", "")
 
+if getattr(settings, "TINYLINK_ASYNC_VIEWS", False):
+    redirect_view = tinylink_redirect_async
+    expand_view = tinylink_expand_async
+else:
+    redirect_view = TinylinkRedirectView.as_view()
+    expand_view = tinylink_expand
+
 urlpatterns = [
     re_path(r"^list/$", TinylinkListView.as_view(), name="tinylink_list"),
     re_path(r"^create/$", TinylinkCreateView.as_view(), name="tinylink_create"),
@@ -67,18 +76,21 @@ urlpatterns += [
         include("rest_framework.urls", namespace="rest_framework"),
     ),
     re_path(r"^api/db-stats/$", db_stats, name="api_db_stats"),
+    re_path(r"^api/latency-stats/$", latency_stats, name="api_latency_stats"),
+    re_path(r"^api/bloom-stats/$", bloom_stats, name="api_bloom_stats"),
     re_path(r"^api/stats/$", stats, name="api_stats"),
+    re_path(r"^api/clicks/$", ingest_clicks, name="api_clicks"),
     re_path(
         r"^api/url-stats/(?P<short_url>\w+)/", tinylink_stats, name="api_url_stats"
     ),
     re_path(
-        r"^api/expand/(?P<short_url>\w+)/$", tinylink_expand, name="api_tinylink_expand"
+        r"^api/expand/(?P<short_url>\w+)/$", expand_view, name="api_tinylink_expand"
     ),
     re_path(
         r"^{}{}".format(
             PREFIX + "/" if PREFIX else "", "(?P<short_url>[a-zA-Z0-9-]+)$"
         ),
-        TinylinkRedirectView.as_view(),
+        redirect_view,
         name="tinylink_redirect",
     ),
 ]
@@ -1,15 +1,22 @@
 """Views for the ``django-tinylinks`` application."""
+import hashlib
+import logging
 import re
 
+from asgiref.sync import sync_to_async
 from django.conf import settings
 from django.contrib.auth import authenticate, get_user_model, login
 from django.contrib.auth.decorators import permission_required
 from django.core.paginator import EmptyPage, PageNotAnInteger, Paginator
 from django.db.models import Q, Sum
-from django.http import Http404
+from django.http import (Http404, HttpResponseGone, HttpResponseNotAllowed,
+                         HttpResponseNotModified, HttpResponseRedirect,
+                         JsonResponse)
 from django.shortcuts import get_list_or_404
 from django.urls import reverse
+from django.utils.cache import patch_cache_control
 from django.utils.decorators import method_decorator
+from django.utils.http import parse_etags
 from django.utils.translation import gettext as _
 from django.views.generic import (CreateView, DeleteView, ListView,
                                   RedirectView, UpdateView)
@@ -17,20 +24,126 @@ from rest_framework import permissions, status, viewsets
 from rest_framework.authentication import (BasicAuthentication,
                                            SessionAuthentication,
                                            TokenAuthentication)
-from rest_framework.decorators import api_view, permission_classes
+from rest_framework.decorators import action, api_view, permission_classes
 from rest_framework.response import Response
 from rest_framework.routers import APIRootView
 from rest_framework.views import APIView
 
+from tinylinks.bloom import short_url_filter
+from tinylinks.buffers import log_writer, view_counter
+from tinylinks.cache import alookup_tinylink, lookup_tinylink
 from tinylinks.forms import TinylinkForm
-from tinylinks.models import Tinylink, TinylinkLog, validate_long_url
-from tinylinks.serializers import TinylinkSerializer, UserSerializer
+from tinylinks.jobs import enqueue_validation
+from tinylinks.metrics import latency_recorder
+from tinylinks.models import Tinylink, TinylinkLog, hash_long_url
+from tinylinks.serializers import (ClickSerializer, TinylinkBulkSerializer,
+                                   TinylinkSerializer, UserSerializer)
 
 User = get_user_model()
 
+logger = logging.getLogger("django.request")
+
 piwik_id = re.compile(r"^_pk_id")
 
 
+def record_click(request, pk):
+    """
+    Counts a click on the tinylink with the primary key ``pk`` and queues
+    the matching ``TinylinkLog`` entry.
+
+    """
+    with latency_recorder.time("counter"):
+        view_counter.increment(pk)
+
+    with latency_recorder.time("cookies"):
+        cookies = request.COOKIES
+        pk_id = ""
+        for key in cookies:
+            if piwik_id.search(key):
+                pk_id = cookies[key]
+
+    with latency_recorder.time("log"):
+        log_writer.add(
+            TinylinkLog(
+                tinylink_id=pk,
+                referrer=request.META.get("HTTP_REFERER", ""),
+                cookie=pk_id,
+                user_agent=request.META.get("HTTP_USER_AGENT", ""),
+                remote_ip=request.META["REMOTE_ADDR"],
+            )
+        )
+
+
+def build_redirect_url(request, url, query_string=False):
+    """
+    Returns the redirect location for ``url`` or ``None`` if it is empty.
+
+    If ``query_string`` is set, the query string of the request is passed on
+    to the redirect location.
+
+    """
+    if not url:
+        return None
+    args = request.META.get("QUERY_STRING", "")
+    if args and query_string:
+        url = "{}?{}".format(url, args)
+    return url
+
+
+def add_cache_headers(request, response, target):
+    """
+    Makes a redirect to ``target`` cacheable by browsers and CDNs.
+
+    The ``Cache-Control`` header is only set if ``TINYLINK_REDIRECT_MAX_AGE``,
+    ``TINYLINK_REDIRECT_SHARED_MAX_AGE`` or the ``cache_max_age`` of the
+    tinylink is set. A ``304`` is returned for matching ``If-None-Match``
+    headers.
+
+    """
+    max_age = getattr(settings, "TINYLINK_REDIRECT_MAX_AGE", None)
+    shared_max_age = target.max_age
+    if shared_max_age is None:
+        shared_max_age = getattr(settings, "TINYLINK_REDIRECT_SHARED_MAX_AGE", None)
+    if response.status_code != 302 or (max_age is None and shared_max_age is None):
+        return response
+
+    if shared_max_age is None:
+        patch_cache_control(response, public=True, max_age=max_age)
+    else:
+        if max_age is None or max_age > shared_max_age:
+            max_age = shared_max_age
+        patch_cache_control(
+            response, public=True, max_age=max_age, s_maxage=shared_max_age
+        )
+    digest = hashlib.blake2b(response["Location"].encode("utf-8"), digest_size=8)
+    response["ETag"] = '"{}"'.format(digest.hexdigest())
+    if_none_match = parse_etags(request.META.get("HTTP_IF_NONE_MATCH", ""))
+    if response["ETag"] in if_none_match or "*" in if_none_match:
+        # ``get_conditional_response`` only handles successful responses.
+        not_modified = HttpResponseNotModified()
+        for header in ("Cache-Control", "ETag", "Location"):
+            not_modified[header] = response[header]
+        return not_modified
+    return response
+
+
+def get_redirect_response(request, url, target=None):
+    """
+    Returns the response ``TinylinkRedirectView`` would return for ``url``.
+
+    """
+    url = build_redirect_url(request, url, TinylinkRedirectView.query_string)
+    if url is None:
+        logger.warning(
+            "Gone: %s", request.path, extra={"status_code": 410, "request": request}
+        )
+        return HttpResponseGone()
+    response = HttpResponseRedirect(url)
+    if target is not None:
+        response = add_cache_headers(request, response, target)
+    return response
+
+
 class TinylinkViewMixin(object):
     """
     View to handle general functions for Tinylink objects.
@@ -95,7 +208,7 @@ class TinylinkListView(TinylinkViewMixin, ListView):
                         link = Tinylink.objects.get(pk=link_id)
                     except Tinylink.DoesNotExist:
                         raise Http404
-                    validate_long_url(link)
+                    enqueue_validation([link])
         return super(TinylinkListView, self).dispatch(request, *args, **kwargs)
 
     def get_queryset(self):
@@ -144,39 +257,21 @@ class TinylinkRedirectView(RedirectView):
     """
 
     def dispatch(self, *args, **kwargs):
+        target = None
         if kwargs.get("short_url"):
-            try:
-                tinylink = Tinylink.objects.get(short_url=kwargs.get("short_url"))
-            except Tinylink.DoesNotExist:
-                tinylink = None
+            with latency_recorder.time("lookup"):
+                target = lookup_tinylink(kwargs.get("short_url"))
+            if target is None:
                 self.url = reverse("tinylink_notfound")
-            if tinylink:
+            else:
                 # set the redirect long URL
-                self.url = tinylink.long_url
-                tinylink.amount_of_views += 1
-                tinylink.save()
-
-                try:
-                    ref = self.request.META.get("HTTP_REFERER", "")
-                except KeyError:
-                    ref = ""
-
-                cookies = self.request.COOKIES
-                pk_id = ""
-                for key in cookies:
-                    if piwik_id.search(key):
-                        pk_id = cookies[key]
-
-                tlog = TinylinkLog(
-                    tinylink=tinylink,
-                    referrer=ref,
-                    cookie=pk_id,
-                    user_agent=self.request.META.get("HTTP_USER_AGENT", ""),
-                    remote_ip=self.request.META["REMOTE_ADDR"],
-                )
-                tlog.save()
+                self.url = target.long_url
+                record_click(self.request, target.pk)
 
-        return super(TinylinkRedirectView, self).dispatch(*args, **kwargs)
+        response = super(TinylinkRedirectView, self).dispatch(*args, **kwargs)
+        if target is not None:
+            response = add_cache_headers(self.request, response, target)
+        return response
 
     def get_redirect_url(self, **kwargs):
         """
@@ -186,14 +281,27 @@ class TinylinkRedirectView(RedirectView):
         when the URL has `%` characters.
 
         """
-        if self.url:
-            url = self.url
-            args = self.request.META.get("QUERY_STRING", "")
-            if args and self.query_string:
-                url = "{}?{}".format(url, args)
-            return url
-        else:
-            return None
+        return build_redirect_url(self.request, self.url, self.query_string)
+
+
+async def tinylink_redirect_async(request, short_url):
+    """
+    Asynchronous version of ``TinylinkRedirectView`` for ASGI deployments.
+
+    Clicks are handed to the buffered writers without blocking the event loop.
+    Only if buffering is disabled, they are written from a worker thread.
+
+    """
+    with latency_recorder.time("lookup"):
+        target = await alookup_tinylink(short_url)
+    if target is None:
+        return get_redirect_response(request, reverse("tinylink_notfound"))
+
+    if view_counter.interval and log_writer.interval:
+        record_click(request, target.pk)
+    else:
+        await sync_to_async(record_click)(request, target.pk)
+    return get_redirect_response(request, target.long_url, target)
 
 
 class StatisticsView(ListView):
@@ -234,7 +342,8 @@ class TinylinkViewSet(viewsets.ModelViewSet):
             return Tinylink.objects.filter(user=self.request.user)
 
         query_data = get_list_or_404(
-            Tinylink, Q(short_url=request_url) | Q(long_url=request_url)
+            Tinylink,
+            Q(short_url=request_url) | Q(long_url_hash=hash_long_url(request_url)),
         )
         return query_data
 
@@ -251,6 +360,31 @@ class TinylinkViewSet(viewsets.ModelViewSet):
 
         return Response(data, status=status.HTTP_201_CREATED, headers=headers)
 
+    def perform_update(self, serializer):
+        long_url = serializer.instance.long_url
+        instance = serializer.save()
+        if instance.long_url != long_url:
+            enqueue_validation([instance], long_url_changed=True)
+
+    @action(detail=False, methods=["post"])
+    def bulk(self, request, *args, **kwargs):
+        """
+        Creates tinylinks for a list of long URLs and returns the short URL of
+        each long URL.
+
+        """
+        serializer = TinylinkBulkSerializer(
+            data=request.data, context=self.get_serializer_context()
+        )
+        serializer.is_valid(raise_exception=True)
+        tinylinks = serializer.save()
+        data = {
+            long_url: request.build_absolute_uri(tinylink.get_short_url())
+            for long_url, tinylink in tinylinks.items()
+        }
+
+        return Response(data, status=status.HTTP_200_OK)
+
 
 class ShorterURL(APIView):
     def post(self, request, *args, **kwargs):
@@ -328,6 +462,72 @@ def db_stats(request):
     return Response(data)
 
 
+@api_view(["GET"])
+@permission_classes(
+    [
+        permissions.IsAdminUser,
+    ]
+)
+def latency_stats(request):
+    """
+    Percentiles of the redirect stage durations per worker in milliseconds
+
+    """
+    data = latency_recorder.collect()
+
+    return Response(data)
+
+
+@api_view(["GET"])
+@permission_classes(
+    [
+        permissions.IsAdminUser,
+    ]
+)
+def bloom_stats(request):
+    """
+    Size and expected false positive rate of this worker's short URL filter
+
+    """
+    data = {
+        "enabled": short_url_filter.enabled,
+        "filter": short_url_filter.info(),
+    }
+
+    return Response(data)
+
+
+@api_view(["POST"])
+@permission_classes(
+    [
+        permissions.IsAdminUser,
+    ]
+)
+def ingest_clicks(request):
+    """
+    Records clicks which have been served by a CDN, e.g. from its logs.
+
+    """
+    serializer = ClickSerializer(data=request.data, many=True)
+    serializer.is_valid(raise_exception=True)
+
+    recorded = 0
+    for click in serializer.validated_data:
+        target = lookup_tinylink(click.pop("short_url"))
+        if target is None:
+            continue
+        view_counter.increment(target.pk)
+        log_writer.add(TinylinkLog(tinylink_id=target.pk, **click))
+        recorded += 1
+
+    data = {
+        "recorded": recorded,
+        "unknown": len(serializer.validated_data) - recorded,
+    }
+
+    return Response(data)
+
+
 @api_view(["GET"])
 @permission_classes(
     [
@@ -410,15 +610,72 @@ def tinylink_expand(request, short_url):
 
     """
 
-    tinylink = Tinylink.objects.filter(short_url=short_url)
+    target = lookup_tinylink(short_url)
 
-    if not tinylink:
+    if target is None:
         data = {"message": "Error: Link not found"}
         return Response(data, status=status.HTTP_404_NOT_FOUND)
 
     data = {
-        "short_url": tinylink.first().short_url,
-        "long_url": tinylink.first().long_url,
+        "short_url": short_url,
+        "long_url": target.long_url,
     }
 
     return Response(data)
+
+
+def check_api_access(view, request):
+    """
+    Runs the authentication, permission and throttle checks of the
+    ``@api_view`` function ``view`` for ``request``. Returns the rendered
+    error response or ``None`` if the request may pass.
+
+    """
+    view = view.cls()
+    view.args, view.kwargs = (), {}
+    request = view.initialize_request(request)
+    view.request = request
+    view.headers = view.default_response_headers
+    try:
+        view.initial(request)
+    except Exception as exc:
+        response = view.finalize_response(request, view.handle_exception(exc))
+        return response.render()
+    return None
+
+
+def is_public_api_view(view):
+    """Returns whether the ``@api_view`` function ``view`` allows everybody."""
+    return not view.cls.throttle_classes and all(
+        permission is permissions.AllowAny
+        for permission in view.cls.permission_classes
+    )
+
+
+async def tinylink_expand_async(request, short_url):
+    """
+    Asynchronous version of ``tinylink_expand`` for ASGI deployments.
+
+    The authentication, permission and throttle settings of
+    ``tinylink_expand`` apply. They are checked in a worker thread, unless
+    they allow everybody. Like ``tinylink_expand``, only GET requests are
+    accepted.
+
+    """
+    if request.method not in ("GET", "HEAD"):
+        return HttpResponseNotAllowed(["GET", "HEAD"])
+    if not is_public_api_view(tinylink_expand):
+        denied = await sync_to_async(check_api_access)(tinylink_expand, request)
+        if denied is not None:
+            return denied
+    target = await alookup_tinylink(short_url)
+    if target is None:
+        data = {"message": "Error: Link not found"}
+        return JsonResponse(data, status=status.HTTP_404_NOT_FOUND)
+
+    data = {
+        "short_url": short_url,
+        "long_url": target.long_url,
+    }
+
+    return JsonResponse(data)